@@ -0,0 +1,75 @@
+#!/usr/bin/python3
+"""HTTP Keep-Alive Benchmark
+
+This script measures the request rate a power monitor can sustain,
+first opening a new connection for every request and then issuing
+back-to-back requests on a single persistent HTTP/1.1 connection.
+"""
+
+import argparse
+import socket
+import time
+
+parser = argparse.ArgumentParser()
+parser.add_argument("device", help="host name or address of the power monitor")
+parser.add_argument("--path", help="resource to request", default='/data.json')
+parser.add_argument("--count", help="number of requests in each run", type=int, default=100)
+parser.add_argument("--timeout", help="socket timeout in seconds", type=float, default=5)
+args = parser.parse_args()
+
+def read_response(sock, buffer):
+    # read the header, then use Content-Length to find the end of the body
+    while b'\r\n\r\n' not in buffer:
+        data = sock.recv(4096)
+        if not data:
+            raise ConnectionError('connection closed while reading header')
+        buffer += data
+    header, buffer = buffer.split(b'\r\n\r\n', 1)
+    length = None
+    for line in header.split(b'\r\n')[1:]:
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            length = int(value)
+    if length is None:
+        # no framing - the body runs until the server closes the connection
+        while True:
+            data = sock.recv(4096)
+            if not data:
+                return header, buffer, b''
+            buffer += data
+    while len(buffer) < length:
+        data = sock.recv(4096)
+        if not data:
+            raise ConnectionError('connection closed while reading body')
+        buffer += data
+    return header, buffer[:length], buffer[length:]
+
+def run(keep_alive):
+    connection = 'keep-alive' if keep_alive else 'close'
+    request = (f'GET {args.path} HTTP/1.1\r\nHost: {args.device}\r\n'
+               f'Connection: {connection}\r\n\r\n').encode()
+    address = (socket.gethostbyname(args.device), 80)
+    sock = None
+    buffer = b''
+    start = time.perf_counter()
+    for i in range(args.count):
+        if sock is None:
+            sock = socket.create_connection(address, timeout=args.timeout)
+            # don't let Nagle hold back requests on the persistent connection
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            buffer = b''
+        sock.sendall(request)
+        header, body, buffer = read_response(sock, buffer)
+        if not keep_alive or b'connection: close' in header.lower():
+            sock.close()
+            sock = None
+    elapsed = time.perf_counter() - start
+    if sock is not None:
+        sock.close()
+    return args.count / elapsed
+
+close_rate = run(keep_alive=False)
+print(f'new connection per request: {close_rate:7.1f} requests/sec')
+keep_alive_rate = run(keep_alive=True)
+print(f'persistent connection:      {keep_alive_rate:7.1f} requests/sec')
+print(f'speedup: {keep_alive_rate/close_rate:.2f}x')
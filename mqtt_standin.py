@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+"""MQTT Broker Stand-in
+
+A minimal MQTT 3.1.1 broker for testing the power monitor MQTT publisher
+without a real broker. It accepts connections, acknowledges CONNECT and
+PINGREQ, keeps retained messages, publishes the last will when a client
+drops, and prints every message received. Subscriptions are not supported.
+
+Point a device at it with the CLI command "set mqtt <this host>[:<port>]".
+"""
+
+import argparse
+import asyncio
+import struct
+import time
+
+retained = {}
+
+def show(topic, payload, retain=False):
+    ts = time.strftime('%H:%M:%S')
+    flag = ' (retained)' if retain else ''
+    print(f'{ts} {topic}{flag}: {payload.decode(errors="replace")}', flush=True)
+
+async def read_packet(reader):
+    header = (await reader.readexactly(1))[0]
+    length = 0
+    shift = 0
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        length |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            break
+    return header, await reader.readexactly(length)
+
+def read_string(body, offset):
+    length = struct.unpack_from('>H', body, offset)[0]
+    offset += 2
+    return body[offset:offset+length], offset + length
+
+async def serve(reader, writer):
+    peer = writer.get_extra_info('peername')
+    will = None
+    try:
+        while True:
+            header, body = await read_packet(reader)
+            kind = header & 0xF0
+            if kind == 0x10:        # CONNECT
+                name, offset = read_string(body, 0)
+                level, flags, keepalive = struct.unpack_from('>BBH', body, offset)
+                offset += 4
+                client_id, offset = read_string(body, offset)
+                if flags & 0x04:
+                    will_topic, offset = read_string(body, offset)
+                    will_message, offset = read_string(body, offset)
+                    will = (will_topic.decode(), will_message, bool(flags & 0x20))
+                print(f'{peer} connected as {client_id.decode()}, keepalive {keepalive} s', flush=True)
+                writer.write(bytes([0x20, 2, 0, 0]))
+            elif kind == 0x30:      # PUBLISH
+                topic, offset = read_string(body, 0)
+                if header & 0x06:
+                    offset += 2     # packet identifier for QoS 1 and 2
+                payload = body[offset:]
+                retain = bool(header & 0x01)
+                if retain:
+                    retained[topic.decode()] = payload
+                show(topic.decode(), payload, retain)
+            elif kind == 0xC0:      # PINGREQ
+                writer.write(bytes([0xD0, 0]))
+            elif kind == 0xE0:      # DISCONNECT
+                will = None
+                break
+            else:
+                print(f'{peer} unsupported packet {header:#x}', flush=True)
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    print(f'{peer} disconnected', flush=True)
+    if will is not None:
+        topic, payload, retain = will
+        if retain:
+            retained[topic] = payload
+        show(topic, payload, retain)
+    writer.close()
+
+async def main(port):
+    server = await asyncio.start_server(serve, '0.0.0.0', port)
+    print(f'MQTT stand-in listening on port {port}', flush=True)
+    async with server:
+        await server.serve_forever()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", help="TCP port", type=int, default=1883)
+    args = parser.parse_args()
+    try:
+        asyncio.run(main(args.port))
+    except KeyboardInterrupt:
+        pass
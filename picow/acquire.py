@@ -0,0 +1,100 @@
+import time
+import mlogging as logging
+
+log = logging.getLogger(__name__)
+
+    # locks shared with the worker; without threads everything runs on core 0
+    # and a lock that is always free stands in
+try :
+    from _thread import allocate_lock
+except ImportError :
+    class allocate_lock:
+        def acquire(self, *args):
+            return True
+
+        def release(self):
+            pass
+
+_idleMs = 2                 # worker sleep between schedule checks
+
+    # lateness of periodic work against its schedule, in ms
+class jitter:
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, late):
+        self.count += 1
+        self.total += late
+        if late > self.max :
+            self.max = late
+
+    def reset(self):
+        self.count = self.total = self.max = 0
+
+    def show(self):
+        if self.count == 0 :
+            return f'{self.name} jitter: no samples'
+        return f'{self.name} jitter: mean {self.total/self.count:.1f} ms, max {self.max} ms over {self.count}'
+
+    # Meter and NTC acquisition on the second core. The worker reads each
+    # channel's meter when due and feeds the NTC filter at its sample rate;
+    # the samplers hand readings to the main loop through their double
+    # buffers. Channels are swapped in as a tuple so the worker never sees a
+    # list being changed.
+class worker:
+    def __init__(self, thermometer, ntc_ms=100):
+        self.thermometer = thermometer
+        self.ntc_ms = ntc_ms
+        self.channels = ()
+        self.running = False
+        self.meterJitter = jitter('meter')
+        self.ntcJitter = jitter('NTC')
+        self.errors = 0
+
+    def setChannels(self, channels):
+        for channel in channels :
+            channel.threaded = self.running
+        self.channels = tuple(channels)
+
+        # returns False if threads are not available, leaving acquisition to the main loop
+    def start(self):
+        try :
+            import _thread
+            self.running = True
+            self.setChannels(self.channels)
+            _thread.start_new_thread(self._run, ())
+        except (ImportError, OSError) as e :
+            self.running = False
+            self.setChannels(self.channels)
+            log.warning('acquisition stays on core 0; %s', e)
+            return False
+        log.info('acquisition running on core 1')
+        return True
+
+    def _run(self):
+        ntc_due = time.ticks_ms()
+        while self.running :
+            try :
+                for channel in self.channels :
+                    late = channel.acquire()
+                    if late is not None :
+                        self.meterJitter.add(late)
+                now = time.ticks_ms()
+                late = time.ticks_diff(now, ntc_due)
+                if late >= 0 :
+                    self.ntcJitter.add(late)
+                    self.thermometer.readADC()
+                    ntc_due = time.ticks_add(ntc_due, self.ntc_ms)
+                    if time.ticks_diff(now, ntc_due) >= 0 :
+                        ntc_due = time.ticks_add(now, self.ntc_ms)
+            except Exception :
+                self.errors += 1
+            time.sleep_ms(_idleMs)
+
+    def status(self):
+        state = 'core 1' if self.running else 'core 0'
+        return [f'acquisition on {state}, worker errors = {self.errors}',
+                self.meterJitter.show(), self.ntcJitter.show()]
@@ -13,10 +13,16 @@ from micropython import const
 _IRQ_CENTRAL_CONNECT = const(1)
 _IRQ_CENTRAL_DISCONNECT = const(2)
 _IRQ_GATTS_WRITE = const(3)
+_IRQ_MTU_EXCHANGED = const(21)
 
+_FLAG_READ = const(0x0002)
 _FLAG_WRITE = const(0x0008)
 _FLAG_NOTIFY = const(0x0010)
 
+_DEFAULT_MTU = const(23)
+_PREFERRED_MTU = const(247)
+_ATT_HEADER = const(3)      # notification payload is the MTU less the ATT header
+
 _UART_UUID = bluetooth.UUID("6E400001-B5A3-F393-E0A9-E50E24DCCA9E")
 _UART_TX = (
     bluetooth.UUID("6E400003-B5A3-F393-E0A9-E50E24DCCA9E"),
@@ -31,21 +37,54 @@ _UART_SERVICE = (
     (_UART_TX, _UART_RX),
 )
 
+# binary sample telemetry - each notification is one packed sample record
+_TELEMETRY_UUID = bluetooth.UUID("8E7F1A20-5C3B-4C59-9D1E-3A5C2B1F0A01")
+_TELEMETRY_SAMPLE = (
+    bluetooth.UUID("8E7F1A20-5C3B-4C59-9D1E-3A5C2B1F0A02"),
+    _FLAG_READ | _FLAG_NOTIFY,
+)
+_TELEMETRY_SERVICE = (
+    _TELEMETRY_UUID,
+    (_TELEMETRY_SAMPLE,),
+)
+
 # org.bluetooth.characteristic.gap.appearance.xml
 _ADV_APPEARANCE_GENERIC_COMPUTER = const(128)
 
 
 class BLEUART:
-    def __init__(self, name="mpy-uart", rxbuf=100):
+    def __init__(self, name="mpy-uart", rxbuf=100, txbuf=2048, ringbuf=256):
         ble = bluetooth.BLE()
         self._ble = ble
         self._ble.active(True)
+        self._ble.config(mtu=_PREFERRED_MTU)
         self._ble.irq(self._irq)
-        ((self._tx_handle, self._rx_handle),) = self._ble.gatts_register_services((_UART_SERVICE,))
+        ((self._tx_handle, self._rx_handle), (self._sample_handle,)) = \
+                self._ble.gatts_register_services((_UART_SERVICE, _TELEMETRY_SERVICE))
         # Increase the size of the rx buffer and enable append mode.
         self._ble.gatts_set_buffer(self._rx_handle, rxbuf, True)
+        self._ble.gatts_set_buffer(self._sample_handle, 64)
         self._connections = set()
-        self._rx_buffer = bytearray()
+        self._mtu = {}
+        # Received data is copied into a fixed ring so the IRQ handler does
+        # not allocate. _rx_lines counts the line ends held in the ring.
+        self._rx_ring = bytearray(ringbuf)
+        self._rx_head = 0
+        self._rx_count = 0
+        self._rx_lines = 0
+        self.rx_overflow = 0
+        # Output is collected here and sent in notifications of up to the
+        # negotiated MTU. When the stack runs out of notification buffers the
+        # rest is held until the next flush(). _tx_sent holds how far each
+        # connection has got, so a retry only sends what it is missing.
+        self._tx_buffer = bytearray(txbuf)
+        self._tx_head = 0
+        self._tx_tail = 0
+        self._tx_sent = {}
+        self.tx_dropped = 0
+        self.notifications = 0
+        self.samples = 0
+        self.samples_skipped = 0
         self._handler = None
         # Optionally add services=[_UART_UUID], but this is likely to make the payload too large.
         self._payload = advertising_payload(name=name, appearance=_ADV_APPEARANCE_GENERIC_COMPUTER)
@@ -60,37 +99,186 @@ class BLEUART:
         if event == _IRQ_CENTRAL_CONNECT:
             conn_handle, _, _ = data
             self._connections.add(conn_handle)
+            self._mtu[conn_handle] = _DEFAULT_MTU
+            self._tx_sent[conn_handle] = self._tx_tail
         elif event == _IRQ_CENTRAL_DISCONNECT:
             conn_handle, _, _ = data
             if conn_handle in self._connections:
                 self._connections.remove(conn_handle)
+                del self._mtu[conn_handle]
+                del self._tx_sent[conn_handle]
+            if not self._connections:
+                self._tx_head = self._tx_tail = 0
             # Start advertising again to allow a new connection.
             self._advertise()
+        elif event == _IRQ_MTU_EXCHANGED:
+            conn_handle, mtu = data
+            if conn_handle in self._connections:
+                self._mtu[conn_handle] = mtu
         elif event == _IRQ_GATTS_WRITE:
             conn_handle, value_handle = data
             if conn_handle in self._connections and value_handle == self._rx_handle:
-                self._rx_buffer += self._ble.gatts_read(self._rx_handle)
+                self._receive(self._ble.gatts_read(self._rx_handle))
                 if self._handler:
                     self._handler()
 
+    # copies into the ring a byte at a time; bytes that don't fit are counted
+    # and discarded
+    def _receive(self, data):
+        ring = self._rx_ring
+        size = len(ring)
+        tail = self._rx_head + self._rx_count
+        for b in data:
+            if self._rx_count >= size:
+                self.rx_overflow += 1
+                continue
+            if tail >= size:
+                tail -= size
+            ring[tail] = b
+            tail += 1
+            self._rx_count += 1
+            if b == 10 or b == 13:
+                self._rx_lines += 1
+
     def any(self):
-        return len(self._rx_buffer)
+        return self._rx_count
+
+    # copies up to len(buf) bytes into buf and returns the number copied
+    def readinto(self, buf, sz=None):
+        n = len(buf) if sz is None else min(sz, len(buf))
+        n = min(n, self._rx_count)
+        ring = memoryview(self._rx_ring)
+        size = len(ring)
+        head = self._rx_head
+        first = min(n, size - head)
+        buf[0:first] = ring[head:head+first]
+        if n > first:
+            buf[first:n] = ring[0:n-first]
+        for i in range(n):
+            if buf[i] == 10 or buf[i] == 13:
+                self._rx_lines -= 1
+        head += n
+        if head >= size:
+            head -= size
+        self._rx_head = head
+        self._rx_count -= n
+        return n
 
     def read(self, sz=None):
         if not sz:
-            sz = len(self._rx_buffer)
-        result = self._rx_buffer[0:sz]
-        self._rx_buffer = self._rx_buffer[sz:]
+            sz = self._rx_count
+        result = bytearray(min(sz, self._rx_count))
+        self.readinto(result)
         return result
 
+    # returns the next complete line without its line end, or None if no
+    # line end has been received; empty lines are skipped. A full ring
+    # without a line end is returned as a line so input can't stall.
+    def readline(self):
+        while self._rx_lines or self._rx_count == len(self._rx_ring):
+            ring = self._rx_ring
+            size = len(ring)
+            length = 0
+            while length < self._rx_count:
+                b = ring[(self._rx_head + length) % size]
+                if b == 10 or b == 13:
+                    break
+                length += 1
+            line = bytearray(length)
+            self.readinto(line)
+            if self._rx_count:
+                self._rx_head = (self._rx_head + 1) % size
+                self._rx_count -= 1
+                self._rx_lines -= 1
+            if length:
+                return line
+        return None
+
     def write(self, data):
-        for conn_handle in self._connections:
-            self._ble.gatts_notify(conn_handle, self._tx_handle, data)
+        if not self._connections:
+            return
+        if isinstance(data, str):
+            data = data.encode()
+        buf = self._tx_buffer
+        if self._tx_head and self._tx_tail + len(data) > len(buf):
+            # move the unsent data to the start of the buffer
+            pending = self._tx_tail - self._tx_head
+            view = memoryview(buf)
+            view[0:pending] = view[self._tx_head:self._tx_tail]
+            for conn_handle in self._tx_sent:
+                self._tx_sent[conn_handle] -= self._tx_head
+            self._tx_head = 0
+            self._tx_tail = pending
+        n = min(len(data), len(buf) - self._tx_tail)
+        buf[self._tx_tail:self._tx_tail+n] = data[:n]
+        self._tx_tail += n
+        self.tx_dropped += len(data) - n
+        self.flush()
+
+    def pending(self):
+        return self._tx_tail - self._tx_head
+
+    # sends buffered output to each connection in notifications of its own
+    # MTU; returns False if output remains because the stack is out of
+    # notification buffers
+    def flush(self):
+        if not self._connections:
+            return True
+        view = memoryview(self._tx_buffer)
+        done = True
+        for conn_handle in tuple(self._connections):
+            sent = self._tx_sent.get(conn_handle, self._tx_tail)
+            chunk = self._mtu.get(conn_handle, _DEFAULT_MTU) - _ATT_HEADER
+            try:
+                while sent < self._tx_tail:
+                    n = min(chunk, self._tx_tail - sent)
+                    self._ble.gatts_notify(conn_handle, self._tx_handle, view[sent:sent+n])
+                    sent += n
+                    self.notifications += 1
+            except OSError:
+                done = False
+            if conn_handle in self._tx_sent:
+                self._tx_sent[conn_handle] = sent
+        if done or not self._tx_sent:
+            for conn_handle in self._tx_sent:
+                self._tx_sent[conn_handle] = 0
+            self._tx_head = self._tx_tail = 0
+            return True
+        self._tx_head = min(self._tx_sent.values())
+        return False
+
+    # publishes a packed sample on the telemetry characteristic and notifies
+    # the connections whose MTU holds the whole record; the others are
+    # counted in samples_skipped, as a truncated record is of no use
+    def notify_sample(self, record):
+        if not self._connections:
+            return
+        try:
+            self._ble.gatts_write(self._sample_handle, record)
+            for conn_handle in tuple(self._connections):
+                if self._mtu.get(conn_handle, _DEFAULT_MTU) < len(record) + _ATT_HEADER:
+                    self.samples_skipped += 1
+                    continue
+                self._ble.gatts_notify(conn_handle, self._sample_handle)
+                self.samples += 1
+        except OSError:
+            pass
 
     def close(self):
         for conn_handle in self._connections:
             self._ble.gap_disconnect(conn_handle)
         self._connections.clear()
+        self._mtu.clear()
+        self._tx_sent.clear()
+
+    def status(self):
+        mtu = ', '.join([str(m) for m in self._mtu.values()])
+        return [
+            f'bluetooth connections = {len(self._connections)}, MTU = {mtu}',
+            f'bluetooth notifications = {self.notifications}, samples = {self.samples}, skipped = {self.samples_skipped}',
+            f'bluetooth pending = {self.pending()}, dropped = {self.tx_dropped}',
+            f'bluetooth received = {self.any()}, lines = {self._rx_lines}, overflow = {self.rx_overflow}',
+            ]
 
     def _advertise(self, interval_us=500000):
         self._ble.gap_advertise(interval_us, adv_data=self._payload)
@@ -103,7 +291,10 @@ def demo():
     uart = BLEUART(ble)
 
     def on_rx():
-        print("rx: ", uart.read().decode().strip())
+        line = uart.readline()
+        while line is not None:
+            print("rx: ", line.decode())
+            line = uart.readline()
 
     uart.irq(handler=on_rx)
     nums = [4, 8, 15, 16, 23, 42]
@@ -20,7 +20,7 @@ class config:
                 try :
                         # if so, rename
                     os.rename('passwords.json', config_file)
-                    log.info(f'moving passwords.json to {config_file}')
+                    log.info('moving passwords.json to %s', config_file)
                 except :
                     pass
 
@@ -30,9 +30,9 @@ class config:
             config_data = json.load(f)
             f.close()
         except OSError as e:
-            log.error(f'File {config_file} not found')
+            log.error('File %s not found', config_file)
         except ValueError:
-            log.error('{config_file} does not have a valid json format')
+            log.error('%s does not have a valid json format', config_file)
 
             # we should have at least a hostname in the config file
         if 'hostname' not in config_data:
@@ -58,7 +58,7 @@ class config:
         if element not in self.options:
             self.options.append(element)
         setattr(self, element, value)
-        log.info(f'option {element} set to {value}')
+        log.info('option %s set to %s', element, value)
 
     def save(self):
         config_data = {}
@@ -68,7 +68,7 @@ class config:
         try:
             with open(self.config_file, mode='w', encoding='utf-8') as f:
                 json.dump(config_data, f)
-            log.info(f'Configuration saved to {self.config_file}')
+            log.info('Configuration saved to %s', self.config_file)
         except OSError:
             results = f'Error while writing changes to {self.config_file}'
             log.error(results)
@@ -0,0 +1,191 @@
+from array import array
+import math
+import mlogging as logging
+
+log = logging.getLogger(__name__)
+
+    # (period in seconds, number of records) for each history tier
+TIERS = (
+    (1, 600),       # 1 second for 10 minutes
+    (60, 1440),     # 1 minute for 24 hours
+    (900, 672),     # 15 minutes for a week
+    )
+
+    # shallower tiers for the additional meter channels
+CHANNEL_TIERS = (
+    (1, 60),        # 1 second for a minute
+    (60, 240),      # 1 minute for 4 hours
+    (900, 96),      # 15 minutes for a day
+    )
+
+    # accumulates power and energy samples over an interval
+class summary:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.0
+        self.squares = 0.0      # sum of squared deviations from the first sample
+        self.min = 0.0
+        self.max = 0.0
+        self.first = 0.0        # first power sample, offsets the squares sum
+        self.energy = 0         # energy register at the last sample, Wh
+
+    def add(self, power, energy):
+        if self.count == 0 :
+            self.first = power
+        if self.count == 0 or power < self.min :
+            self.min = power
+        if self.count == 0 or power > self.max :
+            self.max = power
+        self.total += power
+        deviation = power - self.first
+        self.squares += deviation*deviation
+        self.count += 1
+        self.energy = energy
+
+    def mean(self):
+        if self.count == 0 :
+            return 0.0
+        return self.total / self.count
+
+    def stddev(self):
+        if self.count == 0 :
+            return 0.0
+        offset = self.mean() - self.first
+        return math.sqrt(max(0.0, self.squares/self.count - offset*offset))
+
+    # Ring of fixed interval records held in preallocated arrays. Records are
+    # numbered from 1 in the order written, so a caller can ask for everything
+    # newer than the last record it received.
+class tier:
+    def __init__(self, period, depth):
+        self.period = period
+        self.depth = depth
+        self.time = array('I', bytes(4*depth))      # interval start, time.time()
+        self.pmin = array('f', bytes(4*depth))
+        self.pavg = array('f', bytes(4*depth))
+        self.pmax = array('f', bytes(4*depth))
+        self.energy = array('I', bytes(4*depth))    # energy register at end of interval, Wh
+        self.count = 0          # records written, also sequence number of the newest
+        self.start = None       # start time of the interval being accumulated
+        self.bucket = summary()
+
+    def add(self, t, power, energy):
+        start = t - t % self.period
+        if start != self.start :
+            if self.bucket.count :
+                self._close()
+            self.start = start
+        self.bucket.add(power, energy)
+
+    def _close(self):
+        i = self.count % self.depth
+        bucket = self.bucket
+        self.time[i] = self.start
+        self.pmin[i] = bucket.min
+        self.pavg[i] = bucket.mean()
+        self.pmax[i] = bucket.max
+        self.energy[i] = bucket.energy
+        self.count += 1
+        bucket.reset()
+
+        # sequence number of the oldest record still held
+    def oldest(self):
+        return max(1, self.count - self.depth + 1)
+
+        # records with sequence numbers after since, at most limit of them
+        # each record is [seq, time, min, avg, max, energy]
+    def since(self, since, limit):
+        first = max(since + 1, self.oldest())
+        last = min(self.count, first + limit - 1)
+        records = []
+        for seq in range(first, last + 1) :
+            i = (seq - 1) % self.depth
+            records.append([seq, self.time[i], self.pmin[i], self.pavg[i],
+                    self.pmax[i], self.energy[i]/1000])
+        return records
+
+    # Statistics over fixed windows of fast samples, so a host polling once
+    # per window still sees the spread of power within it. The completed
+    # window is held alongside the one being accumulated.
+class window:
+    def __init__(self, period=60):
+        self.period = period
+        self.current = summary()
+        self.last = summary()
+        self.start = None       # start time of the current window
+        self.last_start = None
+        self.last_energy = 0    # energy used in the completed window, Wh
+        self._end_energy = None # energy register at the end of the previous window
+
+    def add(self, t, power, energy):
+        start = t - t % self.period
+        if start != self.start :
+            if self.current.count :
+                self._close()
+            self.start = start
+        self.current.add(power, energy)
+
+    def _close(self):
+        current = self.current
+        self.last, self.current = current, self.last
+        self.last_start = self.start
+        if self._end_energy is None :
+            self._end_energy = current.energy
+        self.last_energy = current.energy - self._end_energy
+        self._end_energy = current.energy
+        self.current.reset()
+
+    def _data(self, s, start, energy):
+        return {
+            'start': start,
+            'count': s.count,
+            'min': s.min,
+            'max': s.max,
+            'mean': s.mean(),
+            'stddev': s.stddev(),
+            'energy': energy/1000,
+            }
+
+        # statistics for the completed and current windows, energy in kWh
+    def data(self):
+        v = {'window': self.period}
+        if self.last_start is not None :
+            v['last'] = self._data(self.last, self.last_start, self.last_energy)
+        if self.current.count :
+            end = self.current.energy if self._end_energy is None else self._end_energy
+            v['current'] = self._data(self.current, self.start, self.current.energy - end)
+        return v
+
+    def show(self):
+        result = []
+        v = self.data()
+        for name in ('last', 'current') :
+            if name in v :
+                w = v[name]
+                result.append(f'{name} {self.period} s window: {w["count"]} samples')
+                result.append(f' power min {w["min"]:.1f} max {w["max"]:.1f} mean {w["mean"]:.1f} stddev {w["stddev"]:.1f} W')
+                result.append(f' energy {w["energy"]:.3f} kWh')
+        if len(result) == 0 :
+            result.append('No samples')
+        return result
+
+class history:
+    def __init__(self, tiers=TIERS):
+        self.tiers = []
+        for period, depth in tiers :
+            self.tiers.append(tier(period, depth))
+
+        # power in W, energy as the raw meter register in Wh
+    def add(self, t, power, energy):
+        for level in self.tiers :
+            level.add(t, power, energy)
+
+    def status(self):
+        result = []
+        for i in range(len(self.tiers)) :
+            t = self.tiers[i]
+            result.append(f'history tier {i}: {t.period} s x {t.depth}, {t.count} records')
+        return result
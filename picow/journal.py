@@ -0,0 +1,155 @@
+import os
+import struct
+import mlogging as logging
+from history import summary
+from peacefair import crc16_value
+
+log = logging.getLogger(__name__)
+
+    # Append-only energy journal kept in a fixed set of preallocated segment
+    # files. Segments are written in turn and the oldest is overwritten when
+    # the newest fills, so flash usage is constant and files never grow.
+    #
+    # Each record:
+    #   0  I  sequence number, 0xFFFFFFFF in an unused slot
+    #   4  I  time.time() at the start of the interval
+    #   8  I  energy register at the end of the interval, Wh
+    #  12  f  minimum power, W
+    #  16  f  average power, W
+    #  20  f  maximum power, W
+    #  24  H  number of samples in the interval
+    #  26  H  CRC-16 of bytes 0-25
+RECORD_FORMAT = '<IIIfffH'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT) + 2
+SEGMENTS = 4
+SEGMENT_RECORDS = 512
+INTERVAL = 300              # seconds per record; 4x512 records covers a week
+_EMPTY = 0xFFFFFFFF
+_segment_size = RECORD_SIZE * SEGMENT_RECORDS
+
+def _segment_file(index):
+    return f'journal{index}.dat'
+
+class journal:
+    def __init__(self, interval=INTERVAL):
+        self.interval = interval
+        self.first = [None] * SEGMENTS  # sequence number of each segment's first record
+        self.segment = 0        # segment being written
+        self.slot = 0           # next slot to write in that segment
+        self.seq = 1            # sequence number of the next record
+        self.start = None
+        self.bucket = summary()
+        self.write_errors = 0
+        self._record = bytearray(RECORD_SIZE)
+        for i in range(SEGMENTS) :
+            self._preallocate(i)
+        self._recover()
+
+    def _preallocate(self, index):
+        name = _segment_file(index)
+        try :
+            if os.stat(name)[6] == _segment_size :
+                return
+        except OSError :
+            pass
+        log.info('creating journal segment %s', name)
+        blank = b'\xff' * RECORD_SIZE * 16
+        with open(name, 'wb') as f :
+            for i in range(SEGMENT_RECORDS // 16) :
+                f.write(blank)
+
+        # reads the record in a slot; returns its sequence number or None if invalid
+    def _read_seq(self, f, slot):
+        f.seek(slot * RECORD_SIZE)
+        n = f.readinto(self._record)
+        if n != RECORD_SIZE :
+            return None
+        seq = struct.unpack_from('<I', self._record, 0)[0]
+        if seq == _EMPTY or crc16_value(self._record) != 0 :
+            return None
+        return seq
+
+        # Only the first record of each segment is read to find the tail
+        # segment, then only the tail segment is scanned for its last record.
+    def _recover(self):
+        tail = None
+        for i in range(SEGMENTS) :
+            with open(_segment_file(i), 'rb') as f :
+                self.first[i] = self._read_seq(f, 0)
+            if self.first[i] is not None and \
+                    (tail is None or self.first[i] > self.first[tail]) :
+                tail = i
+        if tail is None :
+            log.info('journal is empty')
+            return
+        self.segment = tail
+        seq = self.first[tail]
+        slot = 1
+        with open(_segment_file(tail), 'rb') as f :
+            while slot < SEGMENT_RECORDS and self._read_seq(f, slot) == seq + 1 :
+                seq += 1
+                slot += 1
+        self.slot = slot
+        self.seq = seq + 1
+        log.info('journal recovered, next record %d', self.seq)
+
+        # power in W, energy as the raw meter register in Wh
+    def add(self, t, power, energy):
+        start = t - t % self.interval
+        if start != self.start :
+            if self.bucket.count :
+                self._append()
+            self.start = start
+        self.bucket.add(power, energy)
+
+    def _append(self):
+        if self.slot == SEGMENT_RECORDS :
+            self.segment = (self.segment + 1) % SEGMENTS
+            self.slot = 0
+        bucket = self.bucket
+        struct.pack_into(RECORD_FORMAT, self._record, 0, self.seq, self.start,
+                bucket.energy, bucket.min, bucket.mean(), bucket.max, min(bucket.count, 0xFFFF))
+        struct.pack_into('<H', self._record, RECORD_SIZE-2, crc16_value(self._record, RECORD_SIZE-2))
+        bucket.reset()
+        try :
+            with open(_segment_file(self.segment), 'r+b') as f :
+                f.seek(self.slot * RECORD_SIZE)
+                f.write(self._record)
+        except OSError as e :
+            self.write_errors += 1
+            log.error('journal write failed; %s', e)
+            return
+        if self.slot == 0 :
+            self.first[self.segment] = self.seq
+        self.slot += 1
+        self.seq += 1
+
+        # sequence number of the oldest record still held
+    def oldest(self):
+        first = [seq for seq in self.first if seq is not None]
+        if len(first) == 0 :
+            return self.seq
+        return min(first)
+
+        # raw records with sequence numbers after since, in order, at most limit of them
+    def since(self, since, limit):
+        data = b''
+        order = sorted([i for i in range(SEGMENTS) if self.first[i] is not None],
+                key=lambda i: self.first[i])
+        for i in order :
+            first = self.first[i]
+            count = self.slot if i == self.segment else SEGMENT_RECORDS
+            slot = max(0, since + 1 - first)
+            n = min(count - slot, limit - len(data)//RECORD_SIZE)
+            if n <= 0 :
+                continue
+            with open(_segment_file(i), 'rb') as f :
+                f.seek(slot * RECORD_SIZE)
+                data += f.read(n * RECORD_SIZE)
+        return data
+
+    def status(self):
+        return [
+            f'journal records = {self.seq - self.oldest()}, next = {self.seq}',
+            f'journal segment = {self.segment}, slot = {self.slot}, write errors = {self.write_errors}',
+            ]
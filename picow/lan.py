@@ -13,6 +13,16 @@ status_decode = {
     network.STAT_NO_AP_FOUND:   'no AP found',              #-2
     network.STAT_WRONG_PASSWORD:'wrong password',           #-3
     }
+
+connectTimeoutMs = 10000    # time allowed for an attempt to get an IP address
+minBackoffMs = 1000
+maxBackoffMs = 60000
+
+    # Reconnection is a state machine advanced by supervise(), which never
+    # waits. An attempt first connects directly to the last good AP (ssid,
+    # bssid) and only scans when that fails. Failed attempts back off
+    # exponentially. The scan itself still blocks for the time the driver
+    # takes, but is only run after a direct attempt fails.
 class lan():
 
     def wifi_scan(self):
@@ -47,34 +57,136 @@ class lan():
         self.wlan.active(True)
         self.ap = ''
         self.time_of_last_scan = None
-        self.wifi_scan()
+        self.ap_list = []
         self.user_ap_list = []
         self.mac_address = self.wlan.config('mac').hex(':')
+        self.last_good = None       # {'ssid', 'bssid', 'channel'} of the last connection
+        self.state = 'idle'
+        self._candidate = None
+        self._direct = False        # the current attempt is a direct connect
+        self._prefer = None
+        self._backoff = minBackoffMs
+        self._next_attempt = time.ticks_ms()
+        self._deadline = None
+        self._down_since = time.ticks_ms()      # ticks start at boot
+        self.attempts = 0
+        self.direct_connects = 0
+        self.scans = 0
+        self.outages = 0
+        self.boot_connect_ms = None
+        self.last_connect_ms = None
 
     def wifi_list(self):
         self.wifi_scan()
-        self.user_ap_list = copy(self.ap_list)
+        self.user_ap_list = list(self.ap_list)
         response = []
         for index in range(len(self.ap_list)):
             name, rssi = self.ap_list[index]
             response.append(f' {index:2} {rssi:4} {name}')
         return response
 
-    def wifi_connect(self, networks):
+        # restarts the connection, preferring ssid if given; supervise() makes the attempt
+    def wifi_connect(self, networks, ssid=None):
         if self.wlan.isconnected():
             self.wifi_disconnect()
-            time.sleep(1)
+        self._prefer = ssid
+        self._candidate = None
+        self._backoff = minBackoffMs
+        self._next_attempt = time.ticks_ms()
+        self._down_since = time.ticks_ms()
+        self.state = 'idle'
+
+        # returns the strongest known AP found by a scan
+    def _scan_for(self, networks):
+        self.scans += 1
+        best = None
         for ap in self.wlan.scan() :
-            ssid = ap[0].decode() 
-            if ssid in networks:
-                self.wlan.connect(ssid, networks[ssid])
-                self.ap = ssid
-                log.info(f'WIFI is connected to {ssid}')
-                break
+            ssid = ap[0].decode()
+            if ssid not in networks :
+                continue
+            if self._prefer is not None and ssid != self._prefer :
+                continue
+            if best is None or ap[3] > best[3] :
+                best = ap
+        if best is None :
+            return None
+        return {'ssid': best[0].decode(), 'bssid': best[1].hex(':'), 'channel': best[2]}
+
+    def _attempt(self, networks):
+        candidate = self.last_good
+        self._direct = candidate is not None and candidate['ssid'] in networks and \
+                self._prefer in (None, candidate['ssid']) and self._candidate is None
+        if not self._direct :
+            candidate = self._scan_for(networks)
+            if candidate is None :
+                log.info('WIFI no known network found')
+                return False
+        self.attempts += 1
+        ssid = candidate['ssid']
+        log.info('WIFI connecting to %s %s%s', ssid, candidate['bssid'],
+                ' (direct)' if self._direct else '')
+            # the cached bssid and channel let the join skip the scan of every channel
+        self.wlan.connect(ssid, networks[ssid], bssid=bytes.fromhex(candidate['bssid'].replace(':', '')),
+                channel=candidate['channel'])
+        self._candidate = candidate
+        self._deadline = time.ticks_add(time.ticks_ms(), connectTimeoutMs)
+        return True
+
+    def _failed(self, now):
+        log.info('WIFI connect to %s failed - %s', self._candidate['ssid'],
+                status_decode.get(self.wlan.status(), self.wlan.status()))
+        if not self._direct :
+            self._candidate = None
+        self.wlan.disconnect()
+        self._next_attempt = time.ticks_add(now, self._backoff)
+        self._backoff = min(self._backoff*2, maxBackoffMs)
+        self.state = 'backoff'
+
+        # advances the reconnection state machine; returns True when a new
+        # connection has been made
+    def supervise(self, networks):
+        now = time.ticks_ms()
+        if self.wlan.isconnected() :
+            if self.state == 'connected' :
+                return False
+            elapsed = time.ticks_diff(now, self._down_since)
+            if self.boot_connect_ms is None :
+                self.boot_connect_ms = now
+            self.last_connect_ms = elapsed
+            if self._candidate is not None :
+                self.last_good = self._candidate
+                self.ap = self._candidate['ssid']
+                if self._direct :
+                    self.direct_connects += 1
+            self._candidate = None
+            self._prefer = None
+            self._backoff = minBackoffMs
+            self.state = 'connected'
+            log.info('WIFI is connected to %s after %d ms', self.ap, elapsed)
+            return True
+        if self.state == 'connected' :
+            self.outages += 1
+            self._down_since = now
+            self._next_attempt = now
+            self.state = 'idle'
+            log.warning('WIFI connection to %s lost', self.ap)
+        if self.state == 'connecting' :
+            if self.wlan.status() < 0 or time.ticks_diff(now, self._deadline) >= 0 :
+                self._failed(now)
+            return False
+        if not any(networks) or time.ticks_diff(now, self._next_attempt) < 0 :
+            return False
+        if self._attempt(networks) :
+            self.state = 'connecting'
+        else :
+            self._next_attempt = time.ticks_add(now, self._backoff)
+            self._backoff = min(self._backoff*2, maxBackoffMs)
+            self.state = 'backoff'
+        return False
 
     def wifi_disconnect(self):
         self.wlan.disconnect()
-        log.info(f'Disconnecting from WIFI {self.ap}')
+        log.info('Disconnecting from WIFI %s', self.ap)
 
     def status(self):
         response = []
@@ -86,8 +198,14 @@ class lan():
             response.append(f'AP: {self.ap}')
             self.network_ip = self.wlan.ifconfig()[0]
             response.append(f'IP address: {self.network_ip}')
+            if self.last_good is not None :
+                response.append(f'BSSID: {self.last_good["bssid"]}, channel {self.last_good["channel"]}')
         elif status in status_decode :
             response.append( status_decode[status])
         else :
             response.append( f'Unknown status {status}')
+        response.append(f'reconnect state: {self.state}, backoff {self._backoff} ms')
+        response.append(f'attempts = {self.attempts}, direct = {self.direct_connects}, scans = {self.scans}, outages = {self.outages}')
+        if self.boot_connect_ms is not None :
+            response.append(f'boot to connect: {self.boot_connect_ms} ms, last connect took {self.last_connect_ms} ms')
         return response
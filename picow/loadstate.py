@@ -0,0 +1,169 @@
+import socket
+import time
+import ujson as json
+import uasyncio as asyncio
+import mlogging as logging
+
+log = logging.getLogger(__name__)
+
+_maxEvents = 16             # transitions held while the sink is unreachable
+
+    # Classifies the load into states separated by power levels. State 0 is
+    # below levels[0], state n is at or above levels[n-1]. A state is entered
+    # when the power reaches its level and left when the power falls below
+    # the level less the hysteresis percentage. A new state must persist for
+    # dwell consecutive samples before the transition is reported.
+class detector:
+    def __init__(self, levels=(50,), hysteresis=20, dwell=1):
+        self.configure(levels, hysteresis, dwell)
+        self.state = None       # None until the first sample
+        self.since = None       # time.time() of the last transition
+        self.events = []        # pending transitions for the notifier
+        self.dropped = 0        # transitions lost to a full queue
+        self.transitions = 0
+        self._candidate = None
+        self._count = 0
+
+    def configure(self, levels, hysteresis, dwell):
+        self.levels = sorted(levels)
+        self.hysteresis = hysteresis
+        self.dwell = max(1, dwell)
+
+    def _classify(self, power):
+        state = self.state
+        if state is None :
+            state = 0
+            while state < len(self.levels) and power >= self.levels[state] :
+                state += 1
+            return state
+        rising = state
+        while rising < len(self.levels) and power >= self.levels[rising] :
+            rising += 1
+        if rising != state :
+            return rising
+        scale = 1 - self.hysteresis/100
+        while state > 0 and power < self.levels[state-1]*scale :
+            state -= 1
+        return state
+
+        # returns the transition event when the state changes, otherwise None
+    def add(self, t, power):
+        state = self._classify(power)
+        if self.state is None :
+            self.state = state
+            self.since = t
+            return None
+        if state == self.state :
+            self._candidate = None
+            return None
+        if state != self._candidate :
+            self._candidate = state
+            self._count = 0
+        self._count += 1
+        if self._count < self.dwell :
+            return None
+        event = {
+            'time': t,
+            'ticks': time.ticks_ms(),
+            'from': self.state,
+            'to': state,
+            'power': power,
+            'duration': t - self.since,
+            }
+        self.state = state
+        self.since = t
+        self._candidate = None
+        self.transitions += 1
+        if len(self.events) >= _maxEvents :
+            self.events.pop(0)
+            self.dropped += 1
+        self.events.append(event)
+        return event
+
+    def show(self):
+        result = []
+        result.append(f'load levels: {self.levels} W, hysteresis {self.hysteresis}%, dwell {self.dwell}')
+        if self.state is None :
+            result.append('load state: unknown')
+        else :
+            result.append(f'load state: {self.state} for {time.time() - self.since} s')
+        result.append(f'transitions = {self.transitions}, pending = {len(self.events)}, dropped = {self.dropped}')
+        return result
+
+    # Pushes transition events as JSON to a sink given as udp://host:port or
+    # http://host[:port]/path (sent as a POST). getaddrinfo() blocks, so the
+    # address is resolved when the notifier is configured and kept; it is
+    # looked up again only after a failed send.
+class notifier:
+    def __init__(self, sink, hostname, timeout=5):
+        self.sink = sink
+        self.hostname = hostname
+        self.timeout = timeout
+        self.sent = 0
+        self.failures = 0
+        self.scheme, self.host, self.port, self.path = self._split()
+        self.address = None
+        try :
+            self._resolve()
+        except OSError :
+            pass        # network not up yet - resolved on the first send
+
+        # raises ValueError for a sink that can't be used
+    def _split(self):
+        scheme, sep, rest = self.sink.partition('://')
+        hostport, sep, path = rest.partition('/')
+        host, sep, port = hostport.partition(':')
+        if scheme not in ('udp', 'http') :
+            raise ValueError(f'unsupported scheme {scheme}')
+        if not host :
+            raise ValueError('sink has no host')
+        if port :
+            if not port.isdigit() :
+                raise ValueError(f'invalid port {port}')
+            port = int(port)
+        elif scheme == 'udp' :
+            raise ValueError('udp sink needs a port')
+        else :
+            port = 80
+        return (scheme, host, port, '/' + path)
+
+    def _resolve(self):
+        if self.address is None :
+            self.address = socket.getaddrinfo(self.host, self.port)[0][-1]
+        return self.address
+
+    async def send(self, event):
+        event['hostname'] = self.hostname
+        body = json.dumps(event)
+        try :
+            address = self._resolve()
+            if self.scheme == 'udp' :
+                s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                try :
+                    s.sendto(body, address)
+                finally :
+                    s.close()
+            else :
+                    # connect to the resolved IP so open_connection doesn't look the host up again
+                ip = address[0] if isinstance(address, tuple) else self.host
+                await asyncio.wait_for(self._post(ip, self.path, body), self.timeout)
+        except Exception as e :
+            self.address = None     # look the host up again on the next attempt
+            self.failures += 1
+            log.warning('load event to %s failed; %s', self.sink, e)
+            return False
+        self.sent += 1
+        return True
+
+    async def _post(self, ip, path, body):
+        reader, writer = await asyncio.open_connection(ip, self.port)
+        try :
+            writer.write(f'POST {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Type: application/json\r\n'+
+                    f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n{body}')
+            await writer.drain()
+            status = await reader.readline()
+            if len(status.split()) < 2 or not status.split()[1].startswith(b'2') :
+                raise OSError(f'sink responded {status}')
+        finally :
+            writer.close()
+            await writer.wait_closed()
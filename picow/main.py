@@ -1,12 +1,11 @@
 # This file is to be writen to the Raspberry Pi Pico W as main.py
 import machine
-import select
 import time
-import socket
-import errno
 import sys
+import gc
+import random
+import uasyncio as asyncio
 
-from ble_uart_peripheral import BLEUART
 import ujson as json
 
 import mlogging as logging
@@ -14,13 +13,49 @@ import ntc_temp
 
 import lan
 import peacefair
-import line_edit
 import config
 import _version
 import uptime
+import sampler
+import history
+import journal
+import loadstate
+import acquire
+    # bluetooth, the console line editor, telemetry and MQTT are imported
+    # when first used
+
+importMs = time.ticks_ms()  # ticks count from reset
+firstSampleMs = None
+bootFree = None         # free heap once bluetooth, the last to start, is up
 
     # rough sense of time for uptime reporting
 pollTimeoutMs = 100   # 100ms polling
+samplePeriodMs = 200  # default power meter sampling interval
+statsWindowS = 60     # default statistics window
+defaultLevels = [50]  # load state power levels, W
+defaultHysteresis = 20  # percent below a level before its state is left
+defaultDwell = 1      # samples a new load state must persist
+notifyRetryS = 5      # delay before resending a load event that failed
+ntpRetryS = 60        # delay before retrying a failed NTP clock update
+mqttPort = 1883       # default MQTT broker port
+mqttPrefix = 'power'  # default MQTT topic prefix
+defaultMeters = [1]   # modbus slave addresses of the meters on the bus
+logDepth = 32         # log records held for show log and /log
+requestTimeoutS = 5   # time allowed for a client to send its request
+keepAliveTimeoutS = 15  # idle time allowed between requests on a persistent connection
+maxKeepAlive = 4      # connections beyond this are closed after each response
+maxRequestSize = 2048 # bytes allowed in a request header
+responseBufferSize = 1536 # responses up to this size are assembled without allocation
+bufferPoolSize = 4    # preallocated request/response buffer pairs
+maxStreams = 4        # concurrent /stream clients
+streamDrainTimeoutS = 5 # stream clients that can't accept data for this long are dropped
+streamIdleS = 15      # interval of keep-alive comments when no samples arrive
+historyLimit = 120    # maximum records returned by one /history request
+journalLimit = 256    # maximum records returned by one /journal request
+maxCacheEntries = 8   # rendered responses held for the current sample
+contentRefreshMs = 10000 # cached responses are rendered again at least this often
+bleFlushMs = 20       # retry interval for bluetooth output held back by the stack
+bleStartS = 5         # longest wait for the first sample before bluetooth is started
 
 # set up the LED and define routine to toggle
 led = machine.Pin('LED', machine.Pin.OUT)
@@ -28,7 +63,7 @@ def toggleLED() :
     led.value(not led.value())
 
 # set up logging
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=logging.DEBUG, depth=logDepth)
 log = logging.getLogger()
 
 # read configuration data from configuration file
@@ -38,23 +73,114 @@ configuration = config.config(config_file)
     # set up temperature monitoring
 thermometer = ntc_temp.thermometer(configuration)
 
-    # set up access to the power meter
-power_meter = peacefair.powerMeter()
+    # meter and NTC acquisition run on the second core when threads are available
+acquisition = acquire.worker(thermometer)
+loopJitter = acquire.jitter('core 0 loop')
+
+    # set up access to the power meters - one channel per slave address
+meterAddresses = getattr(configuration, 'meters', defaultMeters)
+power_meter = peacefair.powerMeter(meterAddresses)
+if hasattr(configuration, 'sample_ms') :
+        # the main loop collects one sample per pass, so faster sampling would be lost
+    samplePeriodMs = max(int(configuration.sample_ms), pollTimeoutMs)
+if hasattr(configuration, 'window') :
+    statsWindowS = int(configuration.window)
+meter = sampler.sampler(power_meter, thermometer, samplePeriodMs, 0, meterAddresses[0])
+power_history = history.history()
+power_stats = history.window(statsWindowS)
+sampleCount = 0     # new samples on any channel
+
+    # Channel 0 is the primary meter that also feeds the statistics, load
+    # detection and journal. Further channels are sampled on the same
+    # schedule, offset so the meters are read in turn on the shared bus.
+channels = [meter]
+channel_history = [power_history]
+
+def startChannels(addresses):
+    power_meter.addresses = list(addresses)
+    power_meter.address = addresses[0]
+    meter.address = addresses[0]
+    while len(channels) > 1 :
+        channels.pop()
+        channel_history.pop()
+    for i in range(1, len(addresses)) :
+        channels.append(sampler.sampler(power_meter, thermometer, meter.period_ms, i, addresses[i],
+                i*meter.period_ms//len(addresses)))
+        channel_history.append(history.history(history.CHANNEL_TIERS))
+    acquisition.setChannels(channels)
 
-    # activate bluetooth interface
-buart = BLEUART(name=configuration.hostname)
+startChannels(meterAddresses)
+if not acquisition.start() :
+    thermometer.start()
 
+    # load state detection, with transitions pushed to an optional sink
+load_detector = loadstate.detector(
+        getattr(configuration, 'levels', defaultLevels),
+        getattr(configuration, 'hysteresis', defaultHysteresis),
+        getattr(configuration, 'dwell', defaultDwell))
+load_notifier = None
+if getattr(configuration, 'notify', None) :
+    try :
+        load_notifier = loadstate.notifier(configuration.notify, configuration.hostname)
+    except ValueError as e :
+        log.error('notify sink %s ignored; %s', configuration.notify, e)
+
+    # optional UDP multicast of every sample, configured as <group>:<port>;
+    # raises ValueError for a bad destination and OSError if no socket is free
+def startTelemetry(destination):
+    import telemetry
+    group, sep, port = destination.partition(':')
+    return telemetry.broadcaster(group, int(port), configuration.hostname)
+
+telemetry_sender = None
+if getattr(configuration, 'multicast', None) :
+    try :
+        telemetry_sender = startTelemetry(configuration.multicast)
+    except (ValueError, OSError) as e :
+        log.error('multicast destination %s ignored; %s', configuration.multicast, e)
+
+    # optional MQTT publishing, configured as <host>[:<port>]
+mqtt_client = None
+mqtt_task = None
+
+def mqttSample():
+    return (meter.seq, cachedRender('data?', renderData, None))
+
+def startMqtt():
+    global mqtt_client, mqtt_task
+    if mqtt_task is not None :
+        mqtt_task.cancel()
+        mqtt_task = None
+    mqtt_client = None
+    broker = getattr(configuration, 'mqtt', '')
+    if not broker :
+        return
+    import mqtt
+    host, sep, port = broker.partition(':')
+    port = int(port) if port else mqttPort
+    mqtt_client = mqtt.client(host, port, configuration.hostname,
+            getattr(configuration, 'mqtt_prefix', mqttPrefix), mqttSample)
+    mqtt_task = asyncio.create_task(mqtt_client.run())
+energy_journal = journal.journal()
+
+    # the bluetooth interface is started by bleTask once sampling is running
+buart = None
+bleCommand = asyncio.ThreadSafeFlag()
+
+    # runs in IRQ context - received lines wait in the BLEUART ring, which
+    # bounds the queue, until bleCommandTask executes them
 def on_rx():
-    command = buart.read().decode().strip()
-    log.debug(f'bluetooth rx: {command}')
-    result = process_command(command)
-    for line in result:
-        buart.write(line+'\n')
+    bleCommand.set()
 
-buart.irq(handler=on_rx)
+def startBluetooth():
+    global buart
+    from ble_uart_peripheral import BLEUART
+    buart = BLEUART(name=configuration.hostname)
+    buart.irq(handler=on_rx)
 
 # The console IO is not buffered so polling is triggered on the first charactor
 def process_command(command):
+    global load_notifier, telemetry_sender
     result = []
     tokens = command.split()
     num_tokens = len(tokens)
@@ -64,27 +190,61 @@ def process_command(command):
         if num_tokens==1:
             result.append(f'show options:')
             result.append(f' configuration')
+            result.append(f' load')
             result.append(f' log')
             result.append(f' power')
+            result.append(f' statistics')
             result.append(f' status')
             result.append(f' temperature')
             result.append(f' version')
         elif tokens[1].startswith('conf'):      #config
             result = configuration.show()
+        elif tokens[1].startswith('load') :     #load
+            result = load_detector.show()
+            if load_notifier is not None :
+                result.append(f'notify {load_notifier.sink}: sent = {load_notifier.sent}, failures = {load_notifier.failures}')
         elif tokens[1].startswith('log') :      #log
             result.append(f'Log:')
             for m in log.show() :
                 result.append( f' {m}')
         elif tokens[1].startswith('power') :    # peacefair response
-            values = power_meter.read_all()
+            values = meter.read()
             if len(values) == 0 :
                 result.append(f'no power meter response')
             else :
                 for item in values :
                     result.append(f'{item:11}: {values[item]}')
+                result.append(f'{"sample age":11}: {meter.age():.1f} s')
+            for channel in channels[1:] :
+                if channel.seq == 0 :
+                    result.append(f'channel {channel.channel} (address {channel.address}): no response')
+                else :
+                    result.append(f'channel {channel.channel} (address {channel.address}): '+
+                            f'{channel.values["power"][0]:.1f} W, {channel.values["energy"][0]:.3f} kWh')
+        elif tokens[1].startswith('stati') :    #statistics
+            result = power_stats.show()
         elif tokens[1].startswith('stat') :     #stat
             result.append(f'web server state = {server_state}')
             result.append(f'web requests serviced = {request_count}')
+            result.append(f'web connections active = {active_connections}')
+            result.append(f'web streams active = {active_streams}')
+            if heapStats[0] :
+                result.append(f'web heap per request = {heapStats[1]//heapStats[0]} bytes average, {heapStats[2]} max')
+            result.append(f'web collections during requests = {heapStats[3]}, buffer pool misses = {bufferMisses}')
+            for channel in channels :
+                result.append(f'meter {channel.channel} samples = {channel.seq}, failures = {channel.failures}, missed = {channel.missed}')
+            result += acquisition.status()
+            result.append(loopJitter.show())
+            result += power_meter.status()
+            result += power_history.status()
+            result += energy_journal.status()
+            if buart is not None :
+                result += buart.status()
+            if telemetry_sender is not None :
+                result += telemetry_sender.status()
+            if mqtt_client is not None :
+                result += mqtt_client.status()
+            result.append(f'boot: imports done {importMs} ms, first sample {firstSampleMs} ms, {bootFree} bytes free')
             result.append(f'uptime: {uptime.uptime()}')
         elif tokens[1].startswith('temp') :     #temperature
             if 'missing' in thermometer.status :
@@ -107,7 +267,18 @@ def process_command(command):
         if num_tokens==1:
             result.append(f'set options:')
             result.append(f' beta <value>')
+            result.append(f' dwell <samples>')
             result.append(f' hostname <value>')
+            result.append(f' hysteresis <percent>')
+            result.append(f' levels <watts>[,<watts>...]')
+            result.append(f' meters <address>[,<address>...]')
+            result.append(f' meter_address <address> <new address>')
+            result.append(f' mqtt <host>[:<port>] | off')
+            result.append(f' mqtt_prefix <topic prefix>')
+            result.append(f' multicast <group>:<port> | off')
+            result.append(f' notify udp://<host>:<port> | http://<host>[:<port>]/<path> | off')
+            result.append(f' sample_ms <value>')
+            result.append(f' window <seconds>')
         elif num_tokens==2:
             result.append(f'set {tokens[1]} requires a parameter')
         elif num_tokens==3:
@@ -117,6 +288,7 @@ def process_command(command):
                     result.append(f'Error - beta values must be numeric')
                 else :
                     configuration.set('beta', int(value))
+                    thermometer.setBeta(int(value))
             elif tokens[1]=='hostname' :
                 hostname = tokens[2]
                 if hostname.startswith('-') or hostname.endswith('-') :
@@ -132,8 +304,106 @@ def process_command(command):
                             break;
                 if result==[] :     # no result implies no errors, so safe to set hostname
                     configuration.set('hostname', hostname)
+            elif tokens[1]=='sample_ms' :
+                value = tokens[2]
+                if not value.isdigit() or int(value) < pollTimeoutMs :
+                    result.append(f'Error - sample_ms must be a number of at least {pollTimeoutMs}')
+                else :
+                    configuration.set('sample_ms', int(value))
+                    for channel in channels :
+                        channel.period_ms = int(value)
+            elif tokens[1]=='meters' :
+                addresses = tokens[2].split(',')
+                if not all([a.isdigit() and 1 <= int(a) <= peacefair.MAX_ADDRESS for a in addresses]) :
+                    result.append(f'Error - meters must be a comma separated list of addresses 1 to {peacefair.MAX_ADDRESS}')
+                else :
+                    addresses = [int(a) for a in addresses]
+                    configuration.set('meters', addresses)
+                    startChannels(addresses)
+            elif tokens[1]=='levels' :
+                levels = tokens[2].split(',')
+                if not all([level.isdigit() for level in levels]) :
+                    result.append(f'Error - levels must be a comma separated list of numbers')
+                else :
+                    levels = [int(level) for level in levels]
+                    configuration.set('levels', levels)
+                    load_detector.configure(levels, load_detector.hysteresis, load_detector.dwell)
+            elif tokens[1]=='hysteresis' :
+                value = tokens[2]
+                if not value.isdigit() or int(value) >= 100 :
+                    result.append(f'Error - hysteresis must be a percentage below 100')
+                else :
+                    configuration.set('hysteresis', int(value))
+                    load_detector.hysteresis = int(value)
+            elif tokens[1]=='dwell' :
+                value = tokens[2]
+                if not value.isdigit() or int(value) == 0 :
+                    result.append(f'Error - dwell must be a positive number of samples')
+                else :
+                    configuration.set('dwell', int(value))
+                    load_detector.dwell = int(value)
+            elif tokens[1]=='notify' :
+                sink = tokens[2]
+                if sink == 'off' :
+                    configuration.set('notify', '')
+                    load_notifier = None
+                else :
+                    try :
+                        load_notifier = loadstate.notifier(sink, configuration.hostname)
+                        configuration.set('notify', sink)
+                    except ValueError as e :
+                        result.append(f'Error - {e}; notify sink must be udp://<host>:<port> or http://<host>[:<port>]/<path>')
+            elif tokens[1]=='multicast' :
+                destination = tokens[2]
+                sender = None
+                if destination != 'off' :
+                    try :
+                        sender = startTelemetry(destination)
+                    except (ValueError, OSError) as e :
+                        result.append(f'Error - {e}; multicast destination must be <group address>:<port>')
+                if destination == 'off' or sender is not None :
+                        # the old destination is kept until the new one works
+                    if telemetry_sender is not None :
+                        telemetry_sender.close()
+                    telemetry_sender = sender
+                    configuration.set('multicast', destination if sender is not None else '')
+            elif tokens[1]=='mqtt' :
+                broker = tokens[2]
+                host, sep, port = broker.partition(':')
+                if broker == 'off' :
+                    configuration.set('mqtt', '')
+                    startMqtt()
+                elif sep and not port.isdigit() :
+                    result.append(f'Error - mqtt broker must be <host>[:<port>]')
+                else :
+                    configuration.set('mqtt', broker)
+                    startMqtt()
+            elif tokens[1]=='mqtt_prefix' :
+                prefix = tokens[2].strip('/')
+                if not prefix or '+' in prefix or '#' in prefix :
+                    result.append(f'Error - mqtt_prefix must be a topic without wildcards')
+                else :
+                    configuration.set('mqtt_prefix', prefix)
+                    startMqtt()
+            elif tokens[1]=='window' :
+                value = tokens[2]
+                if not value.isdigit() or int(value) == 0 :
+                    result.append(f'Error - window must be a positive number of seconds')
+                else :
+                    configuration.set('window', int(value))
+                    power_stats.period = int(value)
             else :
                 result.append(f'Error - unknown set object {tokens[1]}')
+        elif num_tokens==4 and tokens[1]=='meter_address' :
+            address, new_address = tokens[2:4]
+            if not address.isdigit() or not new_address.isdigit() :
+                result.append(f'Error - meter addresses must be numeric')
+            elif not 1 <= int(new_address) <= peacefair.MAX_ADDRESS :
+                result.append(f'Error - the new address must be 1 to {peacefair.MAX_ADDRESS}')
+            elif power_meter.set_address(int(address), int(new_address)) :
+                result.append(f'Meter {address} now has address {new_address} - update the list with "set meters"')
+            else :
+                result.append(f'Error - meter {address} did not accept the new address')
         else :
             result.append(f'Error - excessive number of parameters for set command')
             
@@ -142,6 +412,8 @@ def process_command(command):
             result.append(f'save options:')
             result.append(f' config')
         elif tokens[1]=='config' :
+            if wifi.last_good is not None :
+                configuration.set('wifi_last', wifi.last_good)
             configuration.save()
 
     elif tokens[0] == 'wifi':
@@ -165,7 +437,7 @@ def process_command(command):
             elif tokens[1].startswith('stat'):  #status
                 result = wifi.status()
             else:
-                result.append(f'Error - unknown wifi action {token[1]}')
+                result.append(f'Error - unknown wifi action {tokens[1]}')
         elif num_tokens==4:
             if tokens[1].startswith('con') :    #connect
                 index, password = tokens[2:4]
@@ -178,7 +450,7 @@ def process_command(command):
                     ssid = network[0]
                     configuration.wifi[ssid] = password
                     result.append(f'Use "save config" to add ssid/password to configuration file')
-                    wifi.wifi_connect(configuration.wifi)
+                    wifi.wifi_connect(configuration.wifi, ssid)
                 else :
                     result.append(f'Error - index parameter {index} is out of range')
 
@@ -204,156 +476,743 @@ html_tail = """
     </body>
 </html>
 """
-errorMessages = {
+statusMessages = {
+    200:'OK',
+    304:'Not Modified',
     400:'Bad Request',
     404:'Not Found',
-    405:'Method Not Allowed'
+    405:'Method Not Allowed',
+    431:'Request Header Fields Too Large',
+    503:'Service Unavailable',
     }
-def respondError(cl, code, explain=None):
-    try :
-        cl.send(f'HTTP/1.0 {code} {errorMessages[code]}\r\nContent-type: text/html\r\n\r\n')
-        if explain :
-            cl.send(f'<!DOCTYPE html><html><head><title>{errorMessages[code]}</title></head>'+
-                    f'<body><center><h1>{explain}</h1></center></body></html>\r\n')
-    except ConnectionResetError:
-        log.error(f'ConnectionResetError while generating error response')
-
-    return
-
-def processRequest(cl, request):
-    log.debug(request)
-    response = ''
-    try :
-        header, body = request.split(b'\r\n\r\n', 1)
-    except ValueError :
-        respondError(cl,400, 'Unable to detect blank line separating header from body')
-        return
-    headerLines = header.splitlines()
-    firstHeaderLine = headerLines[0].split()
-    if len(firstHeaderLine) != 3 :
-        respondError(cl,400, 'Missing request parameter')
-        return
-    (method, target, version) = firstHeaderLine
-    if method != b'GET' :
-        respondError(cl,405, 'Only GET method supported')		# Method not supported
-        return
-    if target == b'/' or target == b'/index.html' :
-        html_body = ''
+def respondError(code, explain=None):
+    body = ''
+    if explain :
+        body = (f'<!DOCTYPE html><html><head><title>{statusMessages[code]}</title></head>'+
+                f'<body><center><h1>{explain}</h1></center></body></html>\r\n')
+    return (code, 'text/html', body)
+
+    # Request and response buffers are taken from a preallocated pool so
+    # serving a request doesn't churn the heap. Connections beyond the pool
+    # get buffers of their own.
+bufferPool = [(bytearray(maxRequestSize), bytearray(responseBufferSize)) for i in range(bufferPoolSize)]
+bufferMisses = 0
+
+def takeBuffers():
+    global bufferMisses
+    if bufferPool :
+        return bufferPool.pop()
+    bufferMisses += 1
+    return (bytearray(maxRequestSize), bytearray(responseBufferSize))
+
+def releaseBuffers(buffers):
+    if len(bufferPool) < bufferPoolSize :
+        bufferPool.append(buffers)
+
+    # static pieces of the response header
+statusLines = {}
+for code in statusMessages :
+    statusLines[code] = f'HTTP/1.1 {code} {statusMessages[code]}\r\n'.encode()
+contentTypeLines = {}
+contentLengthField = b'Content-Length: '
+keepAliveTail = b'Connection: keep-alive\r\n\r\n'
+closeTail = b'Connection: close\r\n\r\n'
+
+def putBytes(out, pos, data):
+    end = pos + len(data)
+    out[pos:end] = data
+    return end
+
+def putDecimal(out, pos, value):
+    digits = 1
+    while value >= 10**digits :
+        digits += 1
+    end = pos + digits
+    for i in range(end-1, pos-1, -1) :
+        out[i] = 48 + value % 10
+        value //= 10
+    return end
+
+    # Assembles the response in out and sends it with a single write, so the
+    # header and body leave in the same segment; a lone header segment stalls
+    # behind Nagle and delayed ACK. The header is framed with Content-Length
+    # so the connection can be reused. extraHeaders holds any further header
+    # lines, each ending with CRLF.
+def writeResponse(writer, out, keepAlive, code, contentType, body, extraHeaders=''):
+    if isinstance(body, str) :
+        body = body.encode()
+    typeLine = contentTypeLines.get(contentType)
+    if typeLine is None :
+        typeLine = b'Content-Type: ' + contentType.encode() + b'\r\n'
+        contentTypeLines[contentType] = typeLine
+    pos = putBytes(out, 0, statusLines[code])
+    pos = putBytes(out, pos, typeLine)
+    if code != 304 :
+        pos = putBytes(out, pos, contentLengthField)
+        pos = putDecimal(out, pos, len(body))
+        pos = putBytes(out, pos, b'\r\n')
+    if extraHeaders :
+        pos = putBytes(out, pos, extraHeaders.encode())
+    pos = putBytes(out, pos, keepAliveTail if keepAlive else closeTail)
+    if pos + len(body) <= len(out) :
+        pos = putBytes(out, pos, body)
+        writer.write(memoryview(out)[:pos])
+    else :
+        writer.write(out[:pos] + body)
+
+    # byte by byte compare of buf[start:end] with name, ignoring the case of
+    # buf unless exact is set
+def matchBytes(buf, start, end, name, exact=False):
+    if end - start != len(name) :
+        return False
+    for i in range(len(name)) :
+        b = buf[start+i]
+        if 65 <= b <= 90 and not exact :
+            b |= 0x20
+        if b != name[i] :
+            return False
+    return True
 
-        values = power_meter.read_all(units=True)
-        for item in values :
-            html_body += f'{item:11} = {values[item][0]:10.1f} {values[item][1]}\n'
+def findByte(buf, value, start, end):
+    while start < end and buf[start] != value :
+        start += 1
+    return start
 
+def skipSpace(buf, start, end):
+    while start < end and buf[start] in (9, 32) :
+        start += 1
+    return start
+
+    # Parses the request header held in buf[:end] in place. Only the request
+    # target and the values of the header fields the server uses are copied
+    # out. Returns the request line as [method, target, version] and a
+    # dictionary of those header fields with lower case names.
+requestHeaders = ((b'connection', 'connection'), (b'if-none-match', 'if-none-match'))
+
+def parseRequest(buf, end):
+    lineEnd = findByte(buf, 10, 0, end)
+    stop = lineEnd
+    if stop > 0 and buf[stop-1] == 13 :
+        stop -= 1
+    firstHeaderLine = []
+    pos = 0
+    while pos < stop :
+        tokenEnd = findByte(buf, 32, pos, stop)
+        if tokenEnd > pos :
+                # the method and version are case-sensitive
+            if len(firstHeaderLine) == 0 and matchBytes(buf, pos, tokenEnd, b'GET', True) :
+                firstHeaderLine.append('GET')
+            elif len(firstHeaderLine) == 2 and matchBytes(buf, pos, tokenEnd, b'HTTP/1.1', True) :
+                firstHeaderLine.append('HTTP/1.1')
+            else :
+                firstHeaderLine.append(bytes(buf[pos:tokenEnd]).decode())
+        pos = tokenEnd + 1
+    headers = {}
+    pos = lineEnd + 1
+    while pos < end :
+        lineEnd = findByte(buf, 10, pos, end)
+        colon = findByte(buf, 58, pos, lineEnd)
+        if colon < lineEnd :
+            for name, key in requestHeaders :
+                if matchBytes(buf, pos, colon, name) :
+                    start = skipSpace(buf, colon+1, lineEnd)
+                    stop = lineEnd
+                    while stop > start and buf[stop-1] in (9, 13, 32) :
+                        stop -= 1
+                    headers[key] = bytes(buf[start:stop]).decode()
+        pos = lineEnd + 1
+    return (firstHeaderLine, headers)
+
+    # fields that can be selected with /data.json?fields=
+dataFields = [peacefair.registers[r][2] for r in peacefair.registers] + \
+        ['age', 'seq', 'temperature', 'hostname', 'stats', 'load', 'channels', 'boot']
+
+    # latest sample as served by /data.json and /stream; fields limits the
+    # result to the listed names, and only those values are computed. The
+    # boot measurement is only included when asked for by name.
+def sampleData(age=True, fields=None):
+    v = {}
+    if fields is None :
+        v |= meter.read()
+    else :
+        for item in fields :
+            if item in meter.values :
+                v[item] = meter.values[item][0]
+    if meter.seq != 0 :
+        if age and (fields is None or 'age' in fields) :
+            v['age'] = meter.age()
+        if fields is None or 'seq' in fields :
+            v['seq'] = meter.seq
+
+    if 'missing' not in thermometer.status and (fields is None or 'temperature' in fields) :
         temperature = thermometer.readTemperature()
-        if 'missing' in thermometer.status :
-            pass
-        elif temperature is None :
-            html_body += f'Temperature: {thermometer.status}\n'
+        if temperature is None :
+            v['temperature'] = thermometer.status
         else :
-            temperature_f = 1.8*temperature+32
-            html_body += f'Temperature = {temperature:.1f} C ({temperature_f:.1f} F)\n'
+            v['temperature'] = temperature
+
+    if configuration.hostname and (fields is None or 'hostname' in fields) :
+        v['hostname'] = configuration.hostname
+
+    if fields is None or 'stats' in fields :
+        v['stats'] = power_stats.data()
+    if load_detector.state is not None and (fields is None or 'load' in fields) :
+        v['load'] = load_detector.state
+    if len(channels) > 1 and (fields is None or 'channels' in fields) :
+        v['channels'] = [channelData(channel, age) for channel in channels]
+    if fields is not None and 'boot' in fields and firstSampleMs is not None and bootFree is not None :
+        v['boot'] = {'imports_ms': importMs, 'first_sample_ms': firstSampleMs, 'free_bytes': bootFree}
+    return v
+
+    # readings of one meter channel for the channels list of sampleData
+def channelData(channel, age):
+    v = channel.read()
+    v['channel'] = channel.channel
+    v['address'] = channel.address
+    if channel.seq != 0 :
+        v['seq'] = channel.seq
+        if age :
+            v['age'] = channel.age()
+    return v
+
+    # splits a request target into the path and a dictionary of query parameters
+def splitTarget(target):
+    path, sep, query = target.partition('?')
+    params = {}
+    if query :
+        for item in query.split('&') :
+            name, sep, value = item.partition('=')
+            params[name] = value
+    return (path, params)
+
+    # records from one history tier newer than the caller's cursor
+def historyData(params):
+    channel = params.get('channel', '0')
+    tier = params.get('tier', '0')
+    since = params.get('since', '0')
+    limit = params.get('limit', str(historyLimit))
+    if not (channel.isdigit() and tier.isdigit() and since.isdigit() and limit.isdigit()) :
+        return respondError(400, 'channel, tier, since and limit must be numeric')
+    channel, tier, since, limit = int(channel), int(tier), int(since), min(int(limit), historyLimit)
+    if channel >= len(channel_history) :
+        return respondError(400, f'channel must be less than {len(channel_history)}')
+    tiers = channel_history[channel].tiers
+    if tier >= len(tiers) :
+        return respondError(400, f'tier must be less than {len(tiers)}')
+    level = tiers[tier]
+    records = level.since(since, limit)
+    v = {
+        'channel': channel,
+        'tier': tier,
+        'period': level.period,
+        'oldest': level.oldest(),
+        'latest': level.count,
+        'seq': records[-1][0] if records else max(since, level.oldest()-1),
+        'fields': ['seq', 'time', 'min', 'avg', 'max', 'energy'],
+        'records': records,
+        }
+    return (200, 'application/json', json.dumps(v))
+
+    # raw journal records newer than the caller's cursor
+def journalData(params):
+    since = params.get('since', '0')
+    limit = params.get('limit', str(journalLimit))
+    if not (since.isdigit() and limit.isdigit()) :
+        return respondError(400, 'since and limit must be numeric')
+    return (200, 'application/octet-stream',
+            energy_journal.since(int(since), min(int(limit), journalLimit)))
+
+    # Representations of the latest sample are rendered once per sample and
+    # the encoded bytes reused until the next sample. The sample age is the
+    # only part that changes within a sample, so it is rendered per request
+    # between the cached parts.
+responseCache = {}      # name: (content version, rendered parts)
 
-        response = 'HTTP/1.0 200 OK\r\nContent-type: text/html\r\n\r\n'
-        response += html_head.format(wifi.hostname) + html_body + html_tail
+    # identifies the content of the cached responses and their entity tags.
+    # The temperature is read between samples and the hostname, load state
+    # and settings can change without one, so a new temperature reading or
+    # contentRefreshMs passing also count - no meter answering doesn't
+    # freeze them
+def contentVersion():
+    return f'{sampleCount}.{thermometer.readCentiC()}.{time.ticks_ms()//contentRefreshMs}'
+
+def cachedRender(name, render, *args):
+    version = contentVersion()
+    entry = responseCache.get(name)
+    if entry is None or entry[0] != version :
+        if len(responseCache) >= maxCacheEntries :
+            responseCache.clear()
+        entry = (version, render(*args))
+        responseCache[name] = entry
+    return entry[1]
+
+def renderIndex():
+    html_body = ''
+    values = meter.read(units=True)
+    for item in values :
+        html_body += f'{item:11} = {values[item][0]:10.1f} {values[item][1]}\n'
+    head = (html_head.format(wifi.hostname) + html_body).encode()
+
+    html_body = ''
+    temperature = thermometer.readTemperature()
+    if 'missing' in thermometer.status :
+        pass
+    elif temperature is None :
+        html_body += f'Temperature: {thermometer.status}\n'
+    else :
+        temperature_f = 1.8*temperature+32
+        html_body += f'Temperature = {temperature:.1f} C ({temperature_f:.1f} F)\n'
+    return (head, (html_body + html_tail).encode())
+
+def renderData(fields=None):
+    return json.dumps(sampleData(age=False, fields=fields)).encode()
+
+bootTag = '%08x' % random.getrandbits(32)
+
+    # weak entity tags, as the sample age within the body changes between requests
+    # bootTag keeps tags from matching after a reboot restarts the counters
+def sampleTag(name):
+    return f'W/"{name}{bootTag}.{contentVersion()}"'
+
+    # If-None-Match uses weak comparison - the W/ prefix is ignored on both sides
+def notModified(headers, etag):
+    match = headers.get('if-none-match')
+    if match is None :
+        return False
+    if match == '*' :
+        return True
+    if etag.startswith('W/') :
+        etag = etag[2:]
+    for tag in match.split(',') :
+        tag = tag.strip()
+        if tag.startswith('W/') :
+            tag = tag[2:]
+        if tag == etag :
+            return True
+    return False
+
+    # log records newer than the caller's cursor
+def logData(params):
+    since = params.get('since', '0')
+    if not since.isdigit() :
+        return respondError(400, 'since must be numeric')
+    v = {
+        'seq': logging.latest(),
+        'fields': ['seq', 'ticks', 'message'],
+        'records': logging.since(int(since)),
+        }
+    return (200, 'application/json', json.dumps(v))
+
+    # returns (status code, content type, body[, extra headers]) for a request
+def processRequest(firstHeaderLine, headers):
+    if len(firstHeaderLine) != 3 :
+        return respondError(400, 'Missing request parameter')
+    (method, target, version) = firstHeaderLine
+    if method != 'GET' :
+        return respondError(405, 'Only GET method supported')		# Method not supported
+    target, params = splitTarget(target)
+    if target == '/' or target == '/index.html' :
+        etag = sampleTag('h')
+        cacheHeaders = f'ETag: {etag}\r\nCache-Control: no-cache\r\n'
+        if notModified(headers, etag) :
+            return (304, 'text/html', b'', cacheHeaders)
+        head, tail = cachedRender('index', renderIndex)
+        if meter.seq != 0 :
+            head += f'{"Sample age":11} = {meter.age():10.1f} s\n'.encode()
+        return (200, 'text/html', head + tail, cacheHeaders)
         
-    elif target == b'/data.json' :
-        response = 'HTTP/1.0 200 OK\r\nContent-type: application/json\r\n\r\n'
-        v = {}
-        v |= power_meter.read_all()
-
-        if 'missing' not in thermometer.status :
-            temperature = thermometer.readTemperature()
-            if temperature is None :
-                v['temperature'] = thermometer.status
+    elif target == '/data.json' :
+        fields = None
+        if 'fields' in params :
+            fields = params['fields'].split(',')
+            for item in fields :
+                if item not in dataFields :
+                    return respondError(400, f'Unknown field {item}')
+        etag = sampleTag('j')
+        cacheHeaders = f'ETag: {etag}\r\nCache-Control: no-cache\r\n'
+        if notModified(headers, etag) :
+            return (304, 'application/json', b'', cacheHeaders)
+        body = cachedRender('data?' + params.get('fields', ''), renderData, fields)
+        if meter.seq != 0 and (fields is None or 'age' in fields) :
+                # splice the age in ahead of the closing brace
+            age = f'"age": {meter.age()}}}'.encode()
+            if body == b'{}' :
+                body = b'{' + age
             else :
-                v['temperature'] = temperature
+                body = body[:-1] + b', ' + age
+        return (200, 'application/json', body, cacheHeaders)
+
+    elif target == '/data.bin' :
+        channel = params.get('channel', '0')
+        if not channel.isdigit() or int(channel) >= len(channels) :
+            return respondError(400, f'channel must be less than {len(channels)}')
+        sample = channels[int(channel)]
+        if sample.seq == 0 :
+            return respondError(503, 'No sample available')
+        etag = f'"b{bootTag}.{sample.channel}.{sample.seq}"'
+        cacheHeaders = f'ETag: {etag}\r\nCache-Control: no-cache\r\n'
+        if notModified(headers, etag) :
+            return (304, 'application/octet-stream', b'', cacheHeaders)
+        return (200, 'application/octet-stream', sample.record, cacheHeaders)
+
+    elif target == '/history' :
+        return historyData(params)
+
+    elif target == '/journal' :
+        return journalData(params)
 
-        if configuration.hostname :
-            v['hostname'] = configuration.hostname
-        response += json.dumps(v)
+    elif target == '/log' :
+        return logData(params)
 
     else :
-        request = request.decode()
-        log.error(f'{request} {firstHeaderLine}')
-        respondError(cl,404, 'File not found')
+        log.error('%s', firstHeaderLine)
+        return respondError(404, 'File not found')
+
+    # Server-Sent Events - the connection is held open and each new sample is
+    # pushed as an event. Only the latest sample is sent after each write
+    # completes, so a client that drains slower than the sampling rate is
+    # decimated, and one that stops draining altogether is dropped.
+async def streamSamples(writer):
+    global active_streams
+    active_streams += 1
+    try :
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n'+
+                b'Cache-Control: no-cache\r\nConnection: close\r\n\r\n')
+        await asyncio.wait_for(writer.drain(), streamDrainTimeoutS)
+        seq = None
+        while True:
+            if seq == sampleCount :
+                try :
+                    await asyncio.wait_for(sampleEvent.wait(), streamIdleS)
+                except asyncio.TimeoutError :
+                        # comment line keeps proxies and dead peer detection happy
+                    writer.write(b': idle\n\n')
+                    await asyncio.wait_for(writer.drain(), streamDrainTimeoutS)
+                    continue
+            seq = sampleCount
+            writer.write(f'id: {seq}\ndata: {json.dumps(sampleData())}\n\n')
+            await asyncio.wait_for(writer.drain(), streamDrainTimeoutS)
+    except asyncio.TimeoutError :
+        log.warning('stream client not draining - dropped')
+    finally :
+        active_streams -= 1
+
+    # HTTP/1.1 connections persist unless the client asks to close them;
+    # HTTP/1.0 clients must ask for keep-alive
+def wantsKeepAlive(firstHeaderLine, headers):
+    connection = headers.get('connection', '').lower()
+    if len(firstHeaderLine) == 3 and firstHeaderLine[2] == 'HTTP/1.1' :
+        return connection != 'close'
+    return connection == 'keep-alive'
+
+    # Reads into buf, which already holds filled bytes, until it holds a
+    # complete request header. Returns (header length, filled) or None at end
+    # of stream. Blank lines between requests are dropped.
+async def readRequest(reader, buf, filled):
+    view = memoryview(buf)
+    scan = 0
+    while True:
+        skip = 0
+        while skip < filled and buf[skip] in (10, 13) :
+            skip += 1
+        if skip :
+            view[0:filled-skip] = view[skip:filled]
+            filled -= skip
+        while scan < filled :
+            if buf[scan] == 10 :
+                following = scan + 1
+                if following < filled and buf[following] == 13 :
+                    following += 1
+                if following < filled and buf[following] == 10 :
+                    return (following + 1, filled)
+                if following >= filled :
+                    break       # wait for more data to decide
+            scan += 1
+        if filled == len(buf) :
+            raise ValueError('request header too large')
+        n = await reader.readinto(view[filled:])
+        if not n :
+            return None
+        filled += n
+
+    # Heap allocated between parsing a request and writing its response, which
+    # runs without yielding. A fall in gc.mem_alloc() means a collection ran.
+heapStats = [0, 0, 0, 0]    # requests, total bytes, maximum bytes, collections
+
+def heapUsage(before):
+    delta = gc.mem_alloc() - before
+    if delta < 0 :
+        heapStats[3] += 1
         return
+    heapStats[0] += 1
+    heapStats[1] += delta
+    heapStats[2] = max(heapStats[2], delta)
+
+    # each client connection is serviced by its own coroutine, so a client
+    # that connects without sending a request only holds up itself. The
+    # connection is kept open for further requests while fewer than
+    # maxKeepAlive clients are connected.
+async def serveClient(reader, writer):
+    global request_count, active_connections
+    active_connections += 1
+    addr = writer.get_extra_info('peername')
+    log.debug('client connected from %s', addr)
+    timeout = requestTimeoutS   # LG WebTV opens connection without sending request
+    buffers = takeBuffers()
+    buf, out = buffers
+    view = memoryview(buf)
+    filled = 0
     try :
-        cl.send(response)
-    except ConnectionResetError:
-        log.error(f'ConnectionResetError while responding to request')
+        while True:
+            try :
+                request = await asyncio.wait_for(readRequest(reader, buf, filled), timeout)
+            except ValueError :
+                writeResponse(writer, out, False, *respondError(431))
+                await writer.drain()
+                break
+            if request is None :
+                break
+            end, filled = request
+            request_count += 1
+            heap = gc.mem_alloc()
+            try :
+                firstHeaderLine, headers = parseRequest(buf, end)
+            except UnicodeError :
+                writeResponse(writer, out, False, *respondError(400, 'Request is not valid UTF-8'))
+                await writer.drain()
+                break
+                # keep any pipelined bytes for the next request
+            view[0:filled-end] = view[end:filled]
+            filled -= end
+            log.debug('%s', firstHeaderLine)
+            if len(firstHeaderLine) == 3 and firstHeaderLine[0] == 'GET' and \
+                    firstHeaderLine[1] == '/stream' :
+                if active_streams >= maxStreams :
+                    writeResponse(writer, out, False, *respondError(503, 'Too many streams'))
+                    await writer.drain()
+                    break
+                    # a stream holds its connection open, so its buffers go
+                    # back to the pool for other clients
+                releaseBuffers(buffers)
+                buffers = None
+                await streamSamples(writer)
+                break
+            keepAlive = wantsKeepAlive(firstHeaderLine, headers) and \
+                    active_connections <= maxKeepAlive
+            writeResponse(writer, out, keepAlive, *processRequest(firstHeaderLine, headers))
+            heapUsage(heap)
+            await writer.drain()
+            if not keepAlive :
+                break
+            timeout = keepAliveTimeoutS
+    except asyncio.TimeoutError :
+        if timeout == requestTimeoutS :
+            log.error('Connection timeout - closing %s', addr)
+    except OSError as e :
+        log.error('Connection error while responding to request; %s', e)
+    finally :
+        active_connections -= 1
+        if buffers is not None :
+            releaseBuffers(buffers)
+        writer.close()
+        await writer.wait_closed()
 
-    # set up polling for USB console
-poller = select.poll()
-poller.register(sys.stdin, select.POLLIN)
+    # runs a CLI command for the console or bluetooth; a command that fails is
+    # reported to the caller rather than ending its CLI task
+def runCommand(command):
+    try :
+        return process_command(command)
+    except Exception as e :
+        log.error('%s', e)
+        return [f'Error - {command} failed; {e}']
 
-    # initialize the wifi interface
-wifi = lan.lan(configuration.hostname)
+    # console input is read a charactor at a time and assembled by line_edit
+async def consoleTask():
+    console = asyncio.StreamReader(sys.stdin)
+    value = await console.read(1)
+    import line_edit
+    while True:
+        command = line_edit.process_key(value)
+        if command is not None:
+            result = runCommand(command)
+            for line in result:
+                print(line)
+        value = await console.read(1)
 
-    # connect to the wifi
-wifi.wifi_connect(configuration.wifi)
+    # the heap left once everything has started; bluetooth is started last,
+    # after the first sample, so this is called once it is up
+def bootMeasure():
+    global bootFree
+    gc.collect()
+    bootFree = gc.mem_free()
+    log.info('boot: first sample %s ms after reset, imports done %d ms, %d bytes free',
+            firstSampleMs, importMs, bootFree)
 
-server = None
-request_count = 0
-server_state = 'idle'
+    # collect new meter readings - read here unless the worker on core 1 has them
+async def sensorTask():
+    global sampleCount, firstSampleMs
+    while True:
+        start = time.ticks_ms()
+        thermometer.checkStatus()
+        count = sampleCount
+        for i in range(len(channels)) :
+            channel = channels[i]
+            if not channel.threaded :
+                late = channel.acquire()
+                if late is not None :
+                    acquisition.meterJitter.add(late)
+            if not channel.collect() :
+                continue
+            sampleCount += 1
+            values = channel.values
+            t = time.time()
+            power = values['power'][0]
+            energy = int(values['energy'][0]*1000 + 0.5)
+            channel_history[i].add(t, power, energy)
+            if telemetry_sender is not None and wifi.wlan.isconnected() :
+                telemetry_sender.send(channel.record)
+            if buart is not None :
+                buart.notify_sample(channel.record)
+            if i != 0 :
+                continue
+            power_stats.add(t, power, energy)
+            event = load_detector.add(t, power)
+            if event is not None :
+                loadEvent.set()
+                loadEvent.clear()
+                if mqtt_client is not None :
+                    mqtt_client.event(json.dumps(event))
+            if clockValid() :
+                    # journal records must have real times to backfill outages
+                energy_journal.add(t, power, energy)
+            if mqtt_client is not None :
+                mqtt_client.wake()
+        if firstSampleMs is None and sampleCount :
+            firstSampleMs = time.ticks_ms()     # power-on to first sample time
+        if sampleCount != count :
+                # wake the /stream clients
+            sampleEvent.set()
+            sampleEvent.clear()
+        await asyncio.sleep_ms(pollTimeoutMs)
+            # anything beyond the sleep is time the loop was held up
+        loopJitter.add(max(0, time.ticks_diff(time.ticks_ms(), start) - pollTimeoutMs))
 
-    # this loop operates on a 100ms tick managed by the poller timeout
-try:
+    # execute bluetooth commands outside IRQ context
+async def bleCommandTask():
+    while True:
+        await bleCommand.wait()
+        while True:
+            line = buart.readline()
+            if line is None :
+                break
+            try :
+                command = line.decode().strip()
+            except UnicodeError :
+                buart.write('Error - command is not valid UTF-8\n')
+                continue
+            log.debug('bluetooth rx: %s', command)
+            result = runCommand(command)
+                # one write so the response is packed into as few notifications as possible
+            buart.write('\n'.join(result)+'\n')
+            await asyncio.sleep_ms(0)
+
+    # starts bluetooth once sampling is running, then sends output held back
+    # while the stack was out of notification buffers
+async def bleTask():
+    try :
+        await asyncio.wait_for(sampleEvent.wait(), bleStartS)
+    except asyncio.TimeoutError :
+        pass        # no meter response - start anyway so the CLI is reachable
+    startBluetooth()
+    bootMeasure()
     while True:
-            # update temperature measurement filter
-        thermometer.readADC()
+        if buart.pending() :
+            buart.flush()
+        await asyncio.sleep_ms(bleFlushMs)
+
+    # push load state transitions to the configured sink, holding them
+    # while the sink is unreachable
+async def notifyTask():
+    while True:
+        if load_notifier is None :
+            load_detector.events.clear()
+        if len(load_detector.events) == 0 or not wifi.wlan.isconnected() :
+            try :
+                await asyncio.wait_for(loadEvent.wait(), 1)
+            except asyncio.TimeoutError :
+                pass
+            continue
+        if await load_notifier.send(load_detector.events[0]) :
+            load_detector.events.pop(0)
+        else :
+            await asyncio.sleep(notifyRetryS)
+
+    # the RTC restarts at the firmware's default date after a power cut, so
+    # the clock is taken as valid once NTP or a host has set a recent date
+def clockValid():
+    return time.gmtime()[0] >= 2024
+
+ntpDue = time.ticks_ms()
+
+def setClock():
+    global ntpDue
+    import ntptime
+    try :
+        ntptime.settime()
+        log.info('clock set from NTP')
+    except Exception as e :
+        log.warning('NTP clock update failed; %s', e)
+        ntpDue = time.ticks_add(time.ticks_ms(), ntpRetryS*1000)
 
-            # set up the server socket when the network comes up
+    # bring the web server up whenever the network is connected
+async def wifiTask():
+    global server, server_state
+    while True:
+            # wifi.last_good stays in memory for a direct connect after the
+            # next outage; "save config" stores it for the next boot
+        wifi.supervise(configuration.wifi)
         if server is None :
             if wifi.wlan.isconnected() :
                 ip_address = wifi.wlan.ifconfig()[0]
-                address = (ip_address, 80)
-                server = socket.socket()
-                server.bind(address)
-                server.listen(5)
-                server.setblocking(False)
-                poller.register(server, select.POLLIN)
-                log.info(f'Server is listening on {ip_address}:80')
+                server = await asyncio.start_server(serveClient, ip_address, 80, backlog=5)
+                server_state = 'listening'
+                log.info('Server is listening on %s:80', ip_address)
                 led.on()
             else :
-                if any(configuration.wifi):
-                    wifi.wifi_connect(configuration.wifi)
                 toggleLED()
+        elif not wifi.wlan.isconnected() :
+            log.warning('network connection lost - stopping server')
+            server.close()
+            await server.wait_closed()
+            server = None
+            server_state = 'idle'
+        if not clockValid() and wifi.wlan.isconnected() and time.ticks_diff(time.ticks_ms(), ntpDue) >= 0 :
+            setClock()
+        await asyncio.sleep_ms(pollTimeoutMs)
 
-            # check and service console and/or web server
-        events = poller.poll(pollTimeoutMs)   # timeout generates empty list
-        for fd, flag in events:
-            if fd == sys.stdin :
-                value = sys.stdin.read(1)
-                command = line_edit.process_key(value)
-                if command is not None:
-                    result = process_command(command)
-                    for line in result:
-                        print(line)
-
-            elif fd == server :
-                server_state = 'busy'
-                request_count += 1
-                try :
-                    cl, addr = server.accept()
-                except OSError as e:
-                    if e.errno != errno.ETIMEDOUT:
-                        log.error(f'Connection accept() error: {e}')
-                    continue
+async def main():
+    asyncio.create_task(sensorTask())
+    asyncio.create_task(consoleTask())
+    asyncio.create_task(notifyTask())
+    asyncio.create_task(bleTask())
+    asyncio.create_task(bleCommandTask())
+    startMqtt()
+    await wifiTask()
 
-                server_state = addr
-                log.debug(f'client connected from {addr}')
-                cl.settimeout(5)    # LG WebTV opens connection without sending request
-                try :
-                    request = cl.recv(1024)
-                except OSError as e:
-                    log.error(f'Connection timeout - closing; {e}')
-                else :
-                    processRequest(cl, request)
-                finally :
-                    cl.close()
-                server_state = 'idle'
-            else :
-                log.error(f'unknown fd {fd}')
+    # initialize the wifi interface
+wifi = lan.lan(configuration.hostname)
+wifi.last_good = getattr(configuration, 'wifi_last', None)
+
+server = None
+request_count = 0
+active_connections = 0
+active_streams = 0
+sampleEvent = asyncio.Event()
+loadEvent = asyncio.Event()
+server_state = 'idle'
+
+try:
+    asyncio.run(main())
 except Exception as e:
     e_text = str(e)
-    log.error(f'Fatal exceptioni in main loop - {e_text}')
+    log.error('Fatal exceptioni in main loop - %s', e_text)
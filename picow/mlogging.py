@@ -1,8 +1,8 @@
 from machine import ADC
 from machine import mem32
 from machine import Pin
-
-_messages = []
+from array import array
+import time
 
 # determine if the USB is connected or able to accept additional output data
 # Method 1 - look for power on USB interface
@@ -64,9 +64,59 @@ def _checkLevel(level):
 
 _level = WARNING
 
-def basicConfig(level=INFO):
+# Log records are held in a fixed number of preallocated slots used as a
+# ring. A record keeps the message and its arguments unformatted; the %
+# formatting only runs when the record is printed or read back, and
+# records below the logging level are discarded before anything is stored.
+_depth = 0
+_seq = 0                # sequence number of the newest record
+_seqs = None            # record sequence numbers
+_ticks = None           # time.ticks_ms() when logged
+_levels = None
+_names = [None]
+_msgs = [None]
+_args = [None]
+
+def _allocate(depth):
+    global _depth, _seqs, _ticks, _levels, _names, _msgs, _args
+    _depth = depth
+    _seqs = array('I', bytes(4*depth))
+    _ticks = array('I', bytes(4*depth))
+    _levels = bytearray(depth)
+    _names = [None] * depth
+    _msgs = [None] * depth
+    _args = [None] * depth
+
+_allocate(20)
+
+def basicConfig(level=INFO, depth=None):
     global _level
     _level = _checkLevel(level)
+    if depth is not None and depth != _depth :
+        _allocate(depth)
+
+def _format(i):
+    message = _msgs[i]
+    args = _args[i]
+    if args :
+        try :
+            message = message % args
+        except (TypeError, ValueError) :
+            message = f'{message} {args}'
+    return f'{_levelToName.get(_levels[i], _levels[i])}:{_names[i]}:{message}'
+
+    # slot indexes of the held records with sequence numbers after since, oldest first
+def _slots(since=0):
+    first = max(since + 1, _seq - _depth + 1, 1)
+    return [(seq - 1) % _depth for seq in range(first, _seq + 1)]
+
+    # formatted records with sequence numbers after since - [(seq, ticks, text), ...]
+def since(seq=0):
+    return [(_seqs[i], _ticks[i], _format(i)) for i in _slots(seq)]
+
+    # sequence number of the newest record
+def latest():
+    return _seq
 
 # the official logging library has a concept of parent/child loggers, which
 # currently is not implemented here. This hierarchy is expressed in the
@@ -78,37 +128,49 @@ class getLogger() :
         self.level = level
 
     def clear(self):
-        _messages.clear()
+        global _seq
+        for i in range(_depth) :
+            _msgs[i] = None
+            _args[i] = None
+        _seq = 0
 
     def show(self):
-        return _messages
+        return [_format(i) for i in _slots()]
 
-    def log(self, level, message):
+    def log(self, level, message, *args):
+        global _seq
+        if not isinstance(level, int) :
+            level = _checkLevel(level)
         effectiveLevel = self.level
         if effectiveLevel==NOTSET:
             effectiveLevel = _level
-        if _checkLevel(level) >= effectiveLevel :
-            m = f'{_levelToName[level]}:{self.name}:{message}'
-            if _console and _checkLevel(level) >= WARNING:
-                print(m)
-            _messages.append(m)
-            if len(_messages) > 20:
-                _messages.pop(0)
+        if level < effectiveLevel :
+            return
+        _seq += 1
+        i = (_seq - 1) % _depth
+        _seqs[i] = _seq
+        _ticks[i] = time.ticks_ms()
+        _levels[i] = level
+        _names[i] = self.name
+        _msgs[i] = message
+        _args[i] = args
+        if _console and level >= WARNING:
+            print(_format(i))
 
     def setLevel(self, level):
         self.level = _checkLevel(level)
 
-    def critical(self,message):
-        self.log(CRITICAL, message)
+    def critical(self, message, *args):
+        self.log(CRITICAL, message, *args)
 
-    def error(self,message):
-        self.log(ERROR, message)
+    def error(self, message, *args):
+        self.log(ERROR, message, *args)
 
-    def warning(self,message):
-        self.log(WARNING, message)
+    def warning(self, message, *args):
+        self.log(WARNING, message, *args)
 
-    def info(self,message):
-        self.log(INFO, message)
+    def info(self, message, *args):
+        self.log(INFO, message, *args)
 
-    def debug(self,message):
-        self.log(DEBUG, message)
+    def debug(self, message, *args):
+        self.log(DEBUG, message, *args)
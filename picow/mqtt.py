@@ -0,0 +1,169 @@
+import struct
+import time
+import uasyncio as asyncio
+import mlogging as logging
+
+log = logging.getLogger(__name__)
+
+_CONNECT = 0x10
+_CONNACK = 0x20
+_PUBLISH = 0x30
+_PINGREQ = 0xC0
+_PINGRESP = 0xD0
+_DISCONNECT = 0xE0
+_RETAIN = 0x01
+
+_maxEvents = 16             # load events held while disconnected
+_maxBackoffS = 60
+
+def _string(s):
+    if isinstance(s, str) :
+        s = s.encode()
+    return struct.pack('>H', len(s)) + s
+
+def _packet(header, body):
+    length = len(body)
+    remaining = bytearray()
+    while True:
+        byte = length & 0x7F
+        length >>= 7
+        if length :
+            remaining.append(byte | 0x80)
+        else :
+            remaining.append(byte)
+            break
+    return bytes([header]) + remaining + body
+
+    # MQTT 3.1.1 publisher. One persistent connection carries QoS 0 samples
+    # and load events; <prefix>/<name>/status is retained as online while
+    # connected and set to offline by the broker (last will) when the
+    # connection is lost. Lost connections are retried with exponential
+    # backoff. Only the latest sample is published after each write, so a
+    # slow broker link decimates samples instead of queuing them.
+class client:
+    def __init__(self, host, port, name, prefix, sample, keepalive=60, timeout=10):
+        self.host = host
+        self.port = port
+        self.name = name
+        self.base = f'{prefix}/{name}'
+        self.sample = sample    # function returning (seq, payload) of the latest sample
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.connected = False
+        self.connects = 0
+        self.published = 0
+        self.failures = 0
+        self.events = []
+        self._seq = None
+        self._wake = asyncio.Event()
+        self._reader = None
+        self._writer = None
+
+        # called when a new sample is available
+    def wake(self):
+        self._wake.set()
+
+    def event(self, payload):
+        if len(self.events) >= _maxEvents :
+            self.events.pop(0)
+        self.events.append(payload)
+        self._wake.set()
+
+        # runs until cancelled; cancelling is a deliberate stop, which marks
+        # the status offline and disconnects cleanly
+    async def run(self):
+        backoff = 1
+        try :
+            while True:
+                try :
+                    await self._connect()
+                    backoff = 1
+                    await self._session()
+                except Exception as e :
+                    self.failures += 1
+                    log.warning('mqtt %s:%d - %s', self.host, self.port, e)
+                await self._close()
+                await asyncio.sleep(backoff)
+                backoff = min(backoff*2, _maxBackoffS)
+        finally :
+            await self._stop()
+
+    async def _stop(self):
+        if self.connected :
+            try :
+                await self.publish(self.base + '/status', 'offline', retain=True)
+                await self._send(bytes([_DISCONNECT, 0]))
+            except Exception :
+                pass
+        await self._close()
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout)
+        status = self.base + '/status'
+            # clean session, will retained, QoS 0
+        flags = 0x02 | 0x04 | 0x20
+        body = _string('MQTT') + struct.pack('>BBH', 4, flags, self.keepalive) + \
+                _string(self.name) + _string(status) + _string('offline')
+        await self._send(_packet(_CONNECT, body))
+        response = await asyncio.wait_for(self._reader.readexactly(4), self.timeout)
+        if response[0] != _CONNACK or response[3] != 0 :
+            raise OSError(f'connection refused {response[3]}')
+        self.connected = True
+        self.connects += 1
+        log.info('mqtt connected to %s:%d', self.host, self.port)
+        await self.publish(status, 'online', retain=True)
+
+    async def _close(self):
+        self.connected = False
+        if self._writer is not None :
+            try :
+                self._writer.close()
+                await self._writer.wait_closed()
+            except OSError :
+                pass
+        self._reader = self._writer = None
+
+    async def _send(self, packet):
+        self._writer.write(packet)
+        await asyncio.wait_for(self._writer.drain(), self.timeout)
+
+    async def publish(self, topic, payload, retain=False):
+        header = _PUBLISH | (_RETAIN if retain else 0)
+        if isinstance(payload, str) :
+            payload = payload.encode()
+        await self._send(_packet(header, _string(topic) + payload))
+        self.published += 1
+
+    async def _ping(self):
+        await self._send(bytes([_PINGREQ, 0]))
+        response = await asyncio.wait_for(self._reader.readexactly(2), self.timeout)
+        if response[0] != _PINGRESP :
+            raise OSError(f'unexpected packet {response[0]:#x}')
+
+    async def _session(self):
+        interval = self.keepalive // 2
+        last = time.ticks_ms()
+        while True:
+            try :
+                await asyncio.wait_for(self._wake.wait(), interval)
+            except asyncio.TimeoutError :
+                pass
+            self._wake.clear()
+            while len(self.events) :
+                await self.publish(self.base + '/load', self.events[0])
+                self.events.pop(0)
+            seq, payload = self.sample()
+            if seq != self._seq :
+                self._seq = seq
+                await self.publish(self.base + '/sample', payload)
+            if time.ticks_diff(time.ticks_ms(), last) >= interval*1000 :
+                await self._ping()
+                last = time.ticks_ms()
+
+    def status(self):
+        state = 'connected' if self.connected else 'disconnected'
+        return [
+            f'mqtt {self.host}:{self.port} {state}, topic {self.base}',
+            f'mqtt connects = {self.connects}, published = {self.published}, failures = {self.failures}',
+            ]
@@ -1,6 +1,7 @@
-from machine import ADC, Pin
+from machine import ADC, Pin, Timer
 from micropython import const
 from machine import mem32
+from array import array
 import math
 import mlogging as logging
 
@@ -13,6 +14,9 @@ _mu = 4                     # low-pass filter coefficient (2^-_mu)
 _ntc_beta = 3984            # from the NTC datasheet
 _shorted = 0x1000
 _open    = 0xF000
+_lutShift = 8               # ADC code bits below the lookup table index
+_sampleHz = 10              # filter update rate
+_burstShift = 3             # 2^_burstShift ADC reads averaged per filter update
 
             # The NTC temperature sensor forms part of a resistive divider
             # that feeds the ADC input. The NTC is lower resistor of the divider
@@ -21,6 +25,18 @@ _open    = 0xF000
             #
             # The ADC has noise that causes the temperature reading to bounce around
             # adc_filter holds filtered value as U16.16
+            #
+            # Temperatures are looked up in a table of 0.01 C values at every
+            # 256th ADC code and linearly interpolated, so reading the
+            # temperature needs only integer arithmetic. The table is rebuilt
+            # when beta changes.
+
+    # temperature in 0.01 C for an ADC code, using simplified Steinhart-Hart
+def _centiC(adc_reading, beta):
+    adc_reading = min(max(adc_reading, _shorted), _open)
+    R_overR0 = 1.0/(float(_maxReading) / float(adc_reading) - 1.0)
+    temp_K = 1.0 / (1.0/_T0 + math.log(R_overR0)/beta)
+    return int(round((temp_K - _zeroC)*100))
 
 class thermometer:
     def __init__(self, config):
@@ -60,39 +76,82 @@ class thermometer:
         else :
             self.beta = _ntc_beta
             log.warning('using default value for temperature probe beta')
+        self.lut = array('i', bytes(4*((1 << (16-_lutShift)) + 1)))
+        self.setBeta(self.beta)
+        self.reported = self.status     # status last logged by checkStatus()
+        self.timer = None
+
+        # (re)builds the lookup table for a new probe beta
+    def setBeta(self, beta):
+        self.beta = beta
+        for i in range(len(self.lut)) :
+            self.lut[i] = _centiC(i << _lutShift, beta)
+
+        # The filter is fed from a periodic timer so the sample spacing, and
+        # with it the filter time constant, does not depend on main loop load.
+        # Each update averages a burst of ADC reads to reduce noise.
+    def start(self, freq=_sampleHz):
+        if self.status == 'missing pull-up' :
+            return
+        self.timer = Timer(mode=Timer.PERIODIC, freq=freq, callback=self._tick, hard=False)
 
-        # reads ADC and updates IIR filter if sensor functional
+    def stop(self):
+        if self.timer is not None :
+            self.timer.deinit()
+            self.timer = None
+
+    def _tick(self, timer):
+        self.readADC()
+
+        # reads a burst from the ADC and updates IIR filter if sensor functional
     def readADC(self) :
         if self.status == 'missing pull-up' :
             return
 
-        value = self.temp_adc.read_u16()
+        value = 0
+        read_u16 = self.temp_adc.read_u16
+        for i in range(1 << _burstShift) :
+            value += read_u16()
+        value >>= _burstShift
 
-            # check for bad sensor
+            # check for bad sensor - reported later by checkStatus()
         if value < _shorted :
             self.status = 'NTC shorted'
-            log.warning(self.status)
         elif value > _open :
             self.status = 'NTC open'
-            log.warning(self.status)
         else :
             self.status = 'OK'
         
             # add measurementy to filter
         self.adc_filter += ((value<<16)-self.adc_filter) >> _mu
 
-    # routine to convert ADC reading to temperature
-    # using simplified Steinhart-Hart equation
-    def readTemperature(self) :
+        # logs sensor status changes; called from the main loop
+    def checkStatus(self):
+        status = self.status
+        if status != self.reported :
+            if status == 'OK' :
+                log.info('NTC sensor OK')
+            else :
+                log.warning('%s', status)
+            self.reported = status
+
+    # temperature in 0.01 C from the filtered ADC reading, None if the sensor is broken
+    def readCentiC(self) :
             # check for broken sensor
         if self.status != 'OK':
             return None
 
-            # calculate the resistor ratio from the ADC reading
         adc_reading = (self.adc_filter+0x7fff)>>16
-        R_overR0 = 1.0/(float(_maxReading) / float(adc_reading) - 1.0)
-
-        temp_K = 1.0 / (1.0/_T0 + math.log(R_overR0)/_ntc_beta)
-        temp_C = temp_K - _zeroC
-        F = 1.8*temp_C + 32
-        return temp_C
+        i = adc_reading >> _lutShift
+        if i >= len(self.lut) - 1 :
+            return self.lut[-1]
+        low = self.lut[i]
+        fraction = adc_reading & ((1 << _lutShift) - 1)
+        return low + (((self.lut[i+1] - low) * fraction) >> _lutShift)
+
+    # temperature in degrees C for display, None if the sensor is broken
+    def readTemperature(self) :
+        centiC = self.readCentiC()
+        if centiC is None :
+            return None
+        return centiC / 100
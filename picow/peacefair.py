@@ -1,15 +1,36 @@
 from machine import UART
 from machine import Pin
+import array
 import struct
+import time
+from acquire import allocate_lock
 
-def crc16(data) :
+    # table driven Modbus CRC-16 (polynomial 0xA001 reflected)
+def _crc_table():
+    table = array.array('H', bytes(512))
+    for i in range(256) :
+        crc = i
+        for b in range(8) :
+            if crc&0x0001 :
+                crc = (crc >> 1) ^ 0xA001
+            else :
+                crc >>= 1
+        table[i] = crc
+    return table
+
+_crc16_table = _crc_table()
+
+def crc16_value(data, length=None) :
+    if length is None :
+        length = len(data)
     crc = 0xFFFF
-    for d in data :
-        crc ^= d
-        for i in range(8) :
-            if crc&0x0001 : crc ^= 0xA001<<1
-            crc >>= 1
-    return struct.pack('H',crc)
+    table = _crc16_table
+    for i in range(length) :
+        crc = (crc >> 8) ^ table[(crc ^ data[i]) & 0xFF]
+    return crc
+
+def crc16(data) :
+    return struct.pack('<H',crc16_value(data))
 
     # modbus registers are 16-bit so 32-bit measurements require two registers
 registers = {
@@ -23,30 +44,166 @@ registers = {
         9: (1, 1,       'powerAlarm', ''),
         }
 
-class powerMeter:
-    def __init__(self):
-        self.uart = UART(0, baudrate=9600, tx=Pin(0), rx=Pin(1),timeout=200)
-        self.response = None
+_READ_INPUT = 0x04
+_WRITE_SINGLE = 0x06
+ADDRESS_REGISTER = 0x0002   # holding register with the slave address
+GENERAL_ADDRESS = 0xF8      # answered by any meter - only use with one on the bus
+MAX_ADDRESS = 0xF7
+_interframe_ms = 4      # 3.5 charactor times at 9600 baud
+
+    # Minimal Modbus RTU master. Request frames are built once and cached, and
+    # every response is checked for length, address, function and CRC. A bad
+    # or short response is followed by a resync (inter-frame gap and receive
+    # flush) and a retry. A read that times out is not retried, as a meter
+    # that is off or missing would hold the bus for every retry.
+class modbusRTU:
+    def __init__(self, uart, retries=2):
+        self.uart = uart
+        self.retries = retries
+        self._frames = {}
+        self._buffer = bytearray(256)
+        self.requests = 0
+        self.timeouts = 0
+        self.short_frames = 0
+        self.crc_errors = 0
+        self.exceptions = 0
+        self.retry_count = 0
+
+        # prebuilt frame for a register range, cached by (address, function, start, count)
+    def frame(self, address, function, start, count):
+        key = (address, function, start, count)
+        request = self._frames.get(key)
+        if request is None :
+            request = struct.pack('>2B2H', address, function, start, count)
+            request += crc16(request)
+            self._frames[key] = request
+        return request
 
-    def read_all(self, units=False) :
-        request = struct.pack('>2B2H', 0x01, 0x04, 0, 10)
+    def _resync(self):
+        time.sleep_ms(_interframe_ms)
+        while self.uart.any() :
+            self.uart.read()
+
+        # returns a memoryview of the validated response or None
+    def read_registers(self, address, start, count, function=_READ_INPUT):
+        request = self.frame(address, function, start, count)
+        length = 5 + 2*count
+        response = memoryview(self._buffer)[:length]
+        self.requests += 1
+        for attempt in range(1+self.retries) :
+            if attempt :
+                self.retry_count += 1
+            if self.uart.any() :
+                self._resync()
+            self.uart.write(request)
+            n = self.uart.readinto(response)
+            if not n :
+                self.timeouts += 1
+                return None
+            if n >= 5 and response[1] == function|0x80 and crc16_value(response, 5) == 0 :
+                    # slave responded with an exception code - retry won't help
+                self.exceptions += 1
+                return None
+            if n < length :
+                self.short_frames += 1
+                self._resync()
+                continue
+            if crc16_value(response) != 0 or response[0] != address or \
+                    response[1] != function or response[2] != 2*count :
+                self.crc_errors += 1
+                self._resync()
+                continue
+            return response
+        return None
+
+        # writes one holding register; the slave echoes the request on success
+    def write_register(self, address, register, value):
+        request = struct.pack('>2B2H', address, _WRITE_SINGLE, register, value)
         request += crc16(request)
+        response = memoryview(self._buffer)[:len(request)]
+        self.requests += 1
+        for attempt in range(1+self.retries) :
+            if attempt :
+                self.retry_count += 1
+            if self.uart.any() :
+                self._resync()
+            self.uart.write(request)
+            n = self.uart.readinto(response)
+            if not n :
+                self.timeouts += 1
+                continue
+            if n >= 5 and response[1] == _WRITE_SINGLE|0x80 and crc16_value(response, 5) == 0 :
+                self.exceptions += 1
+                return False
+            if n < len(request) :
+                self.short_frames += 1
+                self._resync()
+                continue
+            if bytes(response) != request :
+                self.crc_errors += 1
+                self._resync()
+                continue
+            return True
+        return False
+
+    def status(self):
+        return [
+            f'modbus requests = {self.requests}, retries = {self.retry_count}',
+            f'modbus timeouts = {self.timeouts}, short frames = {self.short_frames}',
+            f'modbus CRC errors = {self.crc_errors}, exceptions = {self.exceptions}',
+            ]
+
+    # One or more meters sharing UART0, each with its own slave address. The
+    # first address is the default. The bus lock lets the meters be read from
+    # either core.
+class powerMeter:
+    def __init__(self, addresses=(0x01,)):
+        self.uart = UART(0, baudrate=9600, tx=Pin(0), rx=Pin(1), timeout=200, timeout_char=5)
+        self.modbus = modbusRTU(self.uart)
+        self.lock = allocate_lock()
+        self.addresses = list(addresses)
+        self.address = self.addresses[0]
+
+        # copies the 20 bytes of registers 0-9 from the meter at address into
+        # buffer at offset; returns False if the meter did not respond
+    def read_into(self, address, buffer, offset):
+        self.lock.acquire()
+        try :
+            response = self.modbus.read_registers(address, 0, 10)
+            if response is None :
+                return False
+            buffer[offset:offset+20] = response[3:23]
+            return True
+        finally :
+            self.lock.release()
 
-#       print (request)
-        self.uart.write(request)
-        self.response = self.uart.read(25)
+        # measurements from registers 0-9 held big endian at buffer[offset:]
+    def decode(self, buffer, offset=3, units=False):
         meter_values = {}
-        if self.response and len(self.response) is 25 :
-                # first three bytes of response - dev addr, request, length
-            values = struct.unpack('>11H', self.response[3:])  # 11 16-bit shorts, big endian
-            for i in range(len(values)) :
-                if i in registers :
-                    reg = registers[i]
-                    value = 0
-                    for s in range(reg[0]) :
-                        value |= values[i+s] << (s*16)
-                    if units :
-                        meter_values[reg[2]] = (value*reg[1], reg[3])
-                    else :
-                        meter_values[reg[2]] = value*reg[1]
+        values = struct.unpack_from('>10H', buffer, offset)  # 10 16-bit shorts, big endian
+        for i in range(len(values)) :
+            if i in registers :
+                reg = registers[i]
+                value = 0
+                for s in range(reg[0]) :
+                    value |= values[i+s] << (s*16)
+                if units :
+                    meter_values[reg[2]] = (value*reg[1], reg[3])
+                else :
+                    meter_values[reg[2]] = value*reg[1]
         return meter_values
+
+        # gives the meter at address a new slave address; GENERAL_ADDRESS
+        # reaches a meter whose address is unknown when it is alone on the bus
+    def set_address(self, address, new_address):
+        if not 1 <= new_address <= MAX_ADDRESS :
+            raise ValueError(f'slave address must be 1 to {MAX_ADDRESS}')
+        self.lock.acquire()
+        try :
+            return self.modbus.write_register(address, ADDRESS_REGISTER, new_address)
+        finally :
+            self.lock.release()
+
+    def status(self):
+        addresses = ', '.join([str(a) for a in self.addresses])
+        return [f'meter addresses: {addresses}'] + self.modbus.status()
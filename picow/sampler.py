@@ -0,0 +1,138 @@
+import time
+import struct
+import mlogging as logging
+from acquire import allocate_lock
+
+log = logging.getLogger(__name__)
+
+    # Binary sample record served by /data.bin. The layout is fixed and
+    # versioned; change RECORD_VERSION whenever it changes.
+    #   0  B  record layout version
+    #   1  B  register scaling version (see peacefair.registers)
+    #   2  B  meter channel
+    #   3  B  flags
+    #   4  I  sample sequence number
+    #   8  I  time.time() when sampled
+    #  12  I  time.ticks_ms() when sampled
+    #  16  20s meter registers 0-9, big endian as received from the meter
+    #  36  h  temperature in 0.01 C
+RECORD_FORMAT = '<BBBBIII20sh'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+RECORD_VERSION = 1
+SCALING_VERSION = 1
+FLAG_TEMPERATURE = 0x01     # temperature field is valid
+_REGISTERS_OFFSET = 16
+_REGISTERS_SIZE = 20
+_missedLimit = 3            # consecutive failed reads before backing off
+_backoffPeriods = 10        # then the meter is only tried every this many periods
+
+    # The power meter is read on a fixed schedule and the most recent reading
+    # is held here. The HTTP server, BLE and console all serve from this slot
+    # so their latency does not depend on the meter UART.
+    #
+    # Reading (acquire) and serving (collect) are split so the meter can be
+    # read on the second core. acquire() packs each reading into the back half
+    # of a double buffer and swaps the halves under a lock; collect() copies
+    # the front half into record under the same lock. Without a worker thread
+    # the main loop calls both in turn.
+    #
+    # With several meters on the bus there is one sampler per channel, each
+    # reading its own slave address. A meter that stops answering is read
+    # less often until it answers again, so its timeouts don't delay the
+    # other channels every period.
+class sampler:
+    def __init__(self, meter, thermometer=None, period_ms=1000, channel=0, address=None, phase_ms=0):
+        self.meter = meter
+        self.thermometer = thermometer
+        self.period_ms = period_ms
+        self.channel = channel
+        self.address = address  # None reads the meter's default address
+        self.threaded = False   # acquire() is called by the worker thread
+        self.values = {}        # latest reading - name: (value, units)
+        self.ticks = None       # time.ticks_ms() of the latest reading
+        self.seq = 0            # incremented on every successful reading
+        self.failures = 0       # meter reads that returned no data
+        self.missed = 0         # consecutive failed reads
+        self.temperature = None # temperature when sampled, 0.01 C
+        self.record = bytearray(RECORD_SIZE)
+        self._due = time.ticks_add(time.ticks_ms(), phase_ms)
+        self._buffers = (bytearray(RECORD_SIZE), bytearray(RECORD_SIZE))
+        self._front = 0         # buffer holding the latest published reading
+        self._seq = 0           # sequence number of the published reading
+        self._ticks = None
+        self._lock = allocate_lock()
+
+        # reads the meter when due; returns how late the reading started in
+        # ms, or None if it was not due
+    def acquire(self):
+        now = time.ticks_ms()
+        late = time.ticks_diff(now, self._due)
+        if late < 0 :
+            return None
+        self._due = time.ticks_add(self._due, self.period_ms)
+        if time.ticks_diff(now, self._due) >= 0 :
+                # fell more than a period behind - restart the schedule
+            self._due = time.ticks_add(now, self.period_ms)
+        back = self._buffers[1 - self._front]
+        address = self.address if self.address is not None else self.meter.address
+        if not self.meter.read_into(address, back, _REGISTERS_OFFSET) :
+            self.failures += 1
+            self.missed += 1
+            if self.missed >= _missedLimit :
+                self._due = time.ticks_add(self._due, self.period_ms*(_backoffPeriods-1))
+            return late
+        self.missed = 0
+        ticks = time.ticks_ms()
+        self._pack(back, self._seq + 1, ticks)
+        self._lock.acquire()
+        self._front = 1 - self._front
+        self._seq += 1
+        self._ticks = ticks
+        self._lock.release()
+        return late
+
+        # takes the latest published reading; returns True if it is new
+    def collect(self):
+        if self._seq == self.seq :
+            return False
+        self._lock.acquire()
+        self.record[:] = self._buffers[self._front]
+        self.seq = self._seq
+        self.ticks = self._ticks
+        self._lock.release()
+        self.values = self.meter.decode(self.record, _REGISTERS_OFFSET, units=True)
+        flags = self.record[3]
+        if flags & FLAG_TEMPERATURE :
+            self.temperature = struct.unpack_from('<h', self.record, _REGISTERS_OFFSET+_REGISTERS_SIZE)[0]
+        else :
+            self.temperature = None
+        return True
+
+        # fill in the record header and temperature around the registers
+        # already copied from the modbus response
+    def _pack(self, record, seq, ticks):
+        flags = 0
+        temperature = 0
+        if self.thermometer is not None :
+            centiC = self.thermometer.readCentiC()
+            if centiC is not None :
+                flags |= FLAG_TEMPERATURE
+                temperature = centiC
+        struct.pack_into('<BBBBIII', record, 0, RECORD_VERSION, SCALING_VERSION,
+                self.channel, flags, seq, time.time(), ticks & 0xFFFFFFFF)
+        struct.pack_into('<h', record, _REGISTERS_OFFSET+_REGISTERS_SIZE, temperature)
+
+        # seconds since the latest reading, None if the meter has never responded
+    def age(self):
+        if self.ticks is None :
+            return None
+        return time.ticks_diff(time.ticks_ms(), self.ticks) / 1000
+
+        # latest reading as a dictionary of name: value, or name: (value, units)
+    def read(self, units=False):
+        if units :
+            return self.values
+        meter_values = {}
+        for item in self.values :
+            meter_values[item] = self.values[item][0]
+        return meter_values
@@ -0,0 +1,55 @@
+import socket
+import mlogging as logging
+import sampler
+
+log = logging.getLogger(__name__)
+
+    # Each sample is broadcast as one UDP datagram to a multicast group:
+    #   0  4s  magic b'PPT1'
+    #   4  sampler record (sampler.RECORD_FORMAT), which carries the
+    #      sequence number used by receivers for loss detection
+    #   .  B   hostname length followed by the hostname
+    #
+    # MicroPython's lwIP socket doesn't accept IP_MULTICAST_TTL, so datagrams
+    # go out with lwIP's default multicast TTL of 1 and stay on the local
+    # network.
+MAGIC = b'PPT1'
+
+    # raises ValueError unless group is an IPv4 multicast address (224-239)
+    # and port a UDP port number
+class broadcaster:
+    def __init__(self, group, port, hostname):
+        parts = group.split('.')
+        if len(parts) != 4 or not all(p.isdigit() and int(p) <= 255 for p in parts) or \
+                not 224 <= int(parts[0]) <= 239 :
+            raise ValueError(f'{group} is not a multicast group address')
+        if not 0 < port <= 65535 :
+            raise ValueError(f'invalid port {port}')
+        self.address = socket.getaddrinfo(group, port)[0][-1]
+        self.group = group
+        self.port = port
+        self.sent = 0
+        self.errors = 0
+        name = hostname.encode()[:255]
+        self._offset = len(MAGIC)
+        self.packet = bytearray(MAGIC + bytes(sampler.RECORD_SIZE) + bytes([len(name)]) + name)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+
+        # sends a sample record; never blocks - a full transmit buffer drops the datagram
+    def send(self, record):
+        self.packet[self._offset:self._offset+len(record)] = record
+        try :
+            self.socket.sendto(self.packet, self.address)
+        except OSError as e :
+            self.errors += 1
+            if self.errors == 1 :
+                log.warning('telemetry send to %s:%d failed; %s', self.group, self.port, e)
+            return
+        self.sent += 1
+
+    def close(self):
+        self.socket.close()
+
+    def status(self):
+        return [f'telemetry {self.group}:{self.port}: sent = {self.sent}, errors = {self.errors}']
@@ -0,0 +1,117 @@
+"""Power Monitor Binary Records
+
+Decoder for the packed sample records served by the power monitor
+/data.bin resource. The layout matches RECORD_FORMAT in picow/sampler.py.
+Energy journal records served by /journal are decoded by decode_journal(),
+matching picow/journal.py.
+
+Any number of records may be concatenated in one buffer; decode() unpacks
+them all in a single pass.
+"""
+
+import struct
+import urllib.request
+
+RECORD = struct.Struct('<BBBBIII20sh')
+RECORD_VERSION = 1
+JOURNAL_RECORD = struct.Struct('<IIIfffHH')
+FLAG_TEMPERATURE = 0x01
+
+_REGISTERS = struct.Struct('>10H')
+
+# register scaling tables by scaling version
+# address: (width, scaling, name)
+SCALING = {
+    1: {
+        0: (1, 0.1, 'voltage'),
+        1: (2, 0.001, 'current'),
+        3: (2, 0.1, 'power'),
+        5: (2, 0.001, 'energy'),
+        7: (1, 0.1, 'frequency'),
+        8: (1, 0.01, 'powerFactor'),
+        9: (1, 1, 'powerAlarm'),
+    },
+}
+
+def _scale(registers, scaling):
+    values = {}
+    for address, (width, factor, name) in scaling.items():
+        value = registers[address]
+        if width == 2:
+            # 32-bit values are sent low word first
+            value |= registers[address+1] << 16
+        values[name] = value*factor
+    return values
+
+def decode(data):
+    """Decode a buffer of concatenated records into a list of dicts"""
+    if len(data) % RECORD.size:
+        raise ValueError(f'buffer length {len(data)} is not a multiple of {RECORD.size}')
+    samples = []
+    for (version, scaling, channel, flags, seq, timestamp, ticks,
+            raw, temperature) in RECORD.iter_unpack(data):
+        if version != RECORD_VERSION:
+            raise ValueError(f'unsupported record version {version}')
+        if scaling not in SCALING:
+            raise ValueError(f'unsupported scaling version {scaling}')
+        sample = _scale(_REGISTERS.unpack(raw), SCALING[scaling])
+        sample['channel'] = channel
+        sample['seq'] = seq
+        sample['time'] = timestamp
+        sample['ticks'] = ticks
+        if flags & FLAG_TEMPERATURE:
+            sample['temperature'] = temperature/100
+        samples.append(sample)
+    return samples
+
+def _crc16(data):
+    """Modbus CRC-16, as used by the journal records"""
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte
+        for i in range(8):
+            if crc & 1:
+                crc = (crc >> 1) ^ 0xA001
+            else:
+                crc >>= 1
+    return crc
+
+def decode_journal(data):
+    """Decode a buffer of journal records into a list of dicts, dropping
+    records whose CRC doesn't match (torn writes)"""
+    if len(data) % JOURNAL_RECORD.size:
+        raise ValueError(f'buffer length {len(data)} is not a multiple of {JOURNAL_RECORD.size}')
+    records = []
+    size = JOURNAL_RECORD.size
+    for offset in range(0, len(data), size):
+        (seq, start, energy, pmin, pavg, pmax,
+            count, crc) = JOURNAL_RECORD.unpack_from(data, offset)
+        if _crc16(data[offset:offset+size-2]) != crc:
+            continue
+        records.append({
+            'seq': seq,
+            'time': start,
+            'energy': energy/1000,
+            'min': pmin,
+            'avg': pavg,
+            'max': pmax,
+            'count': count,
+            })
+    return records
+
+def read_journal(device, since=0, timeout=5):
+    """Fetch all journal records newer than since from a device"""
+    records = []
+    while True:
+        url = f'http://{device}/journal?since={since}'
+        with urllib.request.urlopen(url, timeout=timeout) as f:
+            batch = decode_journal(f.read())
+        if not batch:
+            return records
+        records += batch
+        since = batch[-1]['seq']
+
+def read_dev(device, timeout=2):
+    """Fetch and decode the latest sample from a device"""
+    with urllib.request.urlopen(f'http://{device}/data.bin', timeout=timeout) as f:
+        return decode(f.read())[0]
@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+"""Power Monitor Telemetry Listener
+
+Receives the UDP multicast samples broadcast by any number of power
+monitors on a single socket. Devices are enabled with the CLI command
+"set multicast <group>:<port>". Each datagram carries the device sequence
+number, so lost datagrams are counted per device. A monitor with several
+meters sends one datagram per meter channel, and each channel is tracked as
+a separate device.
+
+Run directly to print samples as they arrive.
+"""
+
+import argparse
+import socket
+import struct
+import time
+import pp_binary
+
+MAGIC = b'PPT1'
+DEFAULT_GROUP = '239.255.80.80'
+DEFAULT_PORT = 5880
+
+class Device():
+    def __init__(self, name, address, channel=0):
+        self.name = name
+        self.address = address
+        self.channel = channel
+        self.seq = None
+        self.received = 0
+        self.lost = 0
+        self.sample = None
+        self.last_seen = None
+
+    def update(self, sample):
+        # a sequence number that goes backwards means the device rebooted
+        if self.seq is not None and sample['seq'] > self.seq:
+            self.lost += sample['seq'] - self.seq - 1
+        self.seq = sample['seq']
+        self.received += 1
+        self.sample = sample
+        self.last_seen = time.time()
+
+class Listener():
+    def __init__(self, group=DEFAULT_GROUP, port=DEFAULT_PORT, interface='0.0.0.0'):
+        self.devices = {}
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('', port))
+        membership = struct.pack('4s4s', socket.inet_aton(group), socket.inet_aton(interface))
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+
+    def decode(self, data, address):
+        """Returns (device, sample) for a datagram, or None if it is not telemetry"""
+        record_end = len(MAGIC) + pp_binary.RECORD.size
+        if len(data) < record_end + 1 or not data.startswith(MAGIC):
+            return None
+        name_length = data[record_end]
+        name = data[record_end+1:record_end+1+name_length].decode(errors='replace')
+        sample = pp_binary.decode(data[len(MAGIC):record_end])[0]
+        sample['hostname'] = name
+        key = (name, address[0], sample['channel'])
+        device = self.devices.get(key)
+        if device is None:
+            device = Device(name, address[0], sample['channel'])
+            self.devices[key] = device
+        device.update(sample)
+        return device, sample
+
+    def receive(self, timeout=None):
+        """Generator of (device, sample) for every sample received"""
+        self.sock.settimeout(timeout)
+        while True:
+            try:
+                data, address = self.sock.recvfrom(512)
+            except socket.timeout:
+                return
+            result = self.decode(data, address)
+            if result is not None:
+                yield result
+
+    def close(self):
+        self.sock.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--group", help="multicast group", default=DEFAULT_GROUP)
+    parser.add_argument("--port", help="UDP port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    listener = Listener(args.group, args.port)
+    try:
+        for device, sample in listener.receive():
+            ts = time.strftime('%H:%M:%S')
+            print(f'{ts} {device.name:12} {device.channel:2} seq {sample["seq"]:8} {sample["power"]:8.1f} W'
+                  f' {sample["energy"]:10.3f} kWh  lost {device.lost}')
+    except KeyboardInterrupt:
+        pass
+    listener.close()